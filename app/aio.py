@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import asyncio
+import uuid
+import logging
+import weakref
+from email.parser import BytesParser
+from urllib.parse import quote
+
+import httpx
+from google.auth.transport.requests import Request as AuthRequest
+
+from app.classroom import LISTINGS, PAGE_SIZE
+from app.drive import BATCH_SIZE, DRIVE_CHUNK_SIZE, GOOGLE_EXPORTS, META_FIELDS, observe_download, safe_filename
+from app.exportcache import get_export_cache
+from app.metrics import API_RETRIES, CLASSROOM_LIST_SECONDS, DRIVE_METADATA_SECONDS, FILES_SKIPPED
+from app.ratelimit import API_MAX_RETRIES, backoff_delay, get_limiter, is_rate_limited
+from app.transport import HTTP_POOL_SIZE, HTTP_TIMEOUT, get_session
+
+logger = logging.getLogger(__name__)
+
+CLASSROOM_API = "https://classroom.googleapis.com/v1"
+DRIVE_API = "https://www.googleapis.com/drive/v3"
+DRIVE_BATCH_API = "https://www.googleapis.com/batch/drive/v3"
+# How many files past the one currently being zipped may download in parallel.
+PREFETCH_AHEAD = int(os.environ.get("PREFETCH_AHEAD", 4))
+# Upper bound on bytes buffered by prefetching, across all files.
+PREFETCH_MAX_BYTES = int(os.environ.get("PREFETCH_MAX_BYTES", 64 * 1024 * 1024))
+# Listing key -> REST collection it is served from.
+LISTING_PATHS = {
+    "courseWork": "courseWork",
+    "courseWorkMaterial": "courseWorkMaterials",
+}
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    # One client per event loop (normally just the server's) so every
+    # download shares the same keep-alive connections; an httpx client can't
+    # be used from a loop other than the one it first connected on.
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=HTTP_POOL_SIZE),
+            timeout=HTTP_TIMEOUT,
+            # Drive answers some media requests with a redirect to its
+            # content host, as googleapiclient/requests follow silently.
+            follow_redirects=True,
+        )
+    return client
+
+
+class AsyncGoogle:
+    """Minimal asyncio client for the Classroom and Drive REST calls the
+    download path makes. Shares the rate limiter and retry policy with
+    PooledHttp, and refreshes `credentials` off the event loop.
+    """
+
+    def __init__(self, credentials, budget=None, user=None):
+        self.credentials = credentials
+        self.budget = budget
+        self.user = user
+        self.limiter = get_limiter(user)
+        self.client = get_client()
+        self._refresh_lock = asyncio.Lock()
+
+    async def _refresh(self, stale_token):
+        async with self._refresh_lock:
+            # Another task may have refreshed while this one waited.
+            if self.credentials.token == stale_token:
+                await asyncio.to_thread(self.credentials.refresh, AuthRequest(get_session()))
+
+    async def _headers(self):
+        if not self.credentials.valid and getattr(self.credentials, "refresh_token", None):
+            await self._refresh(self.credentials.token)
+        headers = {}
+        self.credentials.apply(headers)
+        return headers
+
+    def _retry(self, attempt):
+        if attempt >= API_MAX_RETRIES:
+            return False
+        return self.budget is None or self.budget.take()
+
+    async def send(self, url, params=None, stream=False, method="GET", content=None, headers=None):
+        attempt = 0
+        refreshed = False
+
+        while True:
+            await self.limiter.acquire_async()
+            token = self.credentials.token
+            try:
+                request = self.client.build_request(
+                    method, url, params=params, content=content,
+                    headers={**(headers or {}), **await self._headers()},
+                )
+                r = await self.client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                if not self._retry(attempt):
+                    raise
+                delay = backoff_delay(attempt)
+                API_RETRIES.inc(reason="connection")
+                logger.warning(f"RETRY {attempt + 1}: {method} {url} failed ({e}); waiting {delay:.1f}s")
+            else:
+                # Only a 2xx is a result; anything else left after redirects
+                # would otherwise be streamed into the archive as file bytes.
+                if r.is_success:
+                    self.limiter.succeeded()
+                    return r
+                await r.aread()
+                if r.status_code == 401 and not refreshed and getattr(self.credentials, "refresh_token", None):
+                    refreshed = True
+                    await self._refresh(token)
+                    continue
+                if not is_rate_limited(r.status_code, r.content):
+                    r.raise_for_status()
+                self.limiter.throttled(r.status_code, r.content)
+                if not self._retry(attempt):
+                    r.raise_for_status()
+                delay = backoff_delay(attempt, r.headers.get("Retry-After"))
+                API_RETRIES.inc(reason=str(r.status_code))
+                logger.warning(f"RETRY {attempt + 1}: {method} {url} got {r.status_code}; waiting {delay:.1f}s")
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get_json(self, url, **params):
+        r = await self.send(url, params)
+        return r.json()
+
+
+async def list_drive_attachments(api, course_id, kind):
+    default_title = LISTINGS[kind]
+    url = f"{CLASSROOM_API}/courses/{course_id}/{LISTING_PATHS[kind]}"
+    files = []
+
+    token = None
+    while True:
+        params = {
+            "pageSize": PAGE_SIZE,
+            "fields": f"nextPageToken,{kind}(title,materials/driveFile/driveFile(id,title))",
+        }
+        if token:
+            params["pageToken"] = token
+        with CLASSROOM_LIST_SECONDS.time(kind=kind):
+            resp = await api.get_json(url, **params)
+
+        for item in resp.get(kind, []):
+            title = item.get("title", default_title)
+            for mat in item.get("materials", []):
+                df = mat.get("driveFile", {}).get("driveFile")
+                if df and df.get("id"):
+                    files.append((df["id"], df.get("title", title)))
+
+        token = resp.get("nextPageToken")
+        if not token:
+            break
+
+    return files
+
+
+async def list_course_files(api, course_id):
+    listings = await asyncio.gather(
+        *(list_drive_attachments(api, course_id, kind) for kind in LISTINGS)
+    )
+    return [f for files in listings for f in files]
+
+
+async def fetch_metadata(api, file_ids, cache=None):
+    # One multipart/mixed POST to Drive's batch endpoint per BATCH_SIZE ids;
+    # ids already in `cache` are not looked up again. Failed lookups are left
+    # out so stream_file falls back to a plain files.get and reports the
+    # error there.
+    cache = {} if cache is None else cache
+    missing = [fid for fid in dict.fromkeys(file_ids) if fid not in cache]
+
+    for i in range(0, len(missing), BATCH_SIZE):
+        try:
+            with DRIVE_METADATA_SECONDS.time(mode="batch"):
+                cache.update(await _batch_metadata(api, missing[i:i + BATCH_SIZE]))
+        except Exception as e:
+            logger.error(f"Metadata batch failed, falling back to per-file lookups. Error: {e}")
+
+    return cache
+
+
+async def _batch_metadata(api, file_ids):
+    boundary = f"batch_{uuid.uuid4().hex}"
+    fields = quote(META_FIELDS, safe=",")
+    body = "".join(
+        f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <{fid}>\r\n\r\n"
+        f"GET /drive/v3/files/{fid}?fields={fields} HTTP/1.1\r\n\r\n"
+        for fid in file_ids
+    ) + f"--{boundary}--\r\n"
+    r = await api.send(
+        DRIVE_BATCH_API, method="POST", content=body.encode(),
+        headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+    )
+
+    message = BytesParser().parsebytes(
+        b"Content-Type: " + r.headers["content-type"].encode() + b"\r\n\r\n" + r.content
+    )
+    found = {}
+    for part in message.get_payload():
+        # Each part is a raw HTTP response; its Content-ID echoes the request's.
+        fid = part["Content-ID"].strip("<>").removeprefix("response-")
+        head, _, payload = part.get_payload(decode=True).partition(b"\r\n\r\n")
+        if head.split(b" ", 2)[1] == b"200":
+            found[fid] = json.loads(payload)
+    return found
+
+
+async def stream_file(api, file_id, chunk_size=DRIVE_CHUNK_SIZE, meta=None, export=None):
+    # Metadata and the first chunk are fetched eagerly so a file that can't be
+    # downloaded is skipped before it gets an entry in the archive. `export`
+    # picks one of the file's export targets (default: the first). Returns
+    # (name, async chunks, mime), mime being the type of the bytes produced
+    # (the export format for Google files).
+    r = None
+    try:
+        if meta is None:
+            with DRIVE_METADATA_SECONDS.time(mode="single"):
+                meta = await api.get_json(f"{DRIVE_API}/files/{file_id}", fields=META_FIELDS)
+        name = safe_filename(meta.get("name"))
+        mime = source_mime = meta.get("mimeType")
+
+        logger.info(f"FETCHING: {name} ({mime})")
+        started = time.perf_counter()
+
+        cached = None
+        if mime in GOOGLE_EXPORTS:
+            export_mime, ext = export or GOOGLE_EXPORTS[mime][0]
+            if not name.lower().endswith(ext):
+                name += ext
+            mime = export_mime
+            exports = get_export_cache()
+            key = exports and exports.key(file_id, export_mime, meta.get("modifiedTime"))
+            if key:
+                cached = exports.read_async(key, chunk_size)
+            if cached is not None:
+                chunks = cached
+            else:
+                r = await api.send(f"{DRIVE_API}/files/{file_id}/export", {"mimeType": export_mime}, stream=True)
+                chunks = r.aiter_bytes(chunk_size)
+                if key:
+                    chunks = exports.store_async(key, chunks)
+        else:
+            r = await api.send(f"{DRIVE_API}/files/{file_id}", {"alt": "media"}, stream=True)
+            chunks = r.aiter_bytes(chunk_size)
+
+        first = await anext(chunks, b"")
+    except Exception as e:
+        if r is not None:
+            await r.aclose()
+        logger.error(f"SKIPPED: ID {file_id} failed. Error: {e}")
+        FILES_SKIPPED.inc(reason="error")
+        return None, None, None
+
+    async def gen():
+        size = len(first)
+        try:
+            yield first
+            async for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        except httpx.HTTPError as e:
+            # The entry is already open in the archive; fail the archive
+            # rather than close a partial file with a valid CRC.
+            logger.error(f"TRUNCATED: {name} failed mid-download. Error: {e}")
+            FILES_SKIPPED.inc(reason="truncated")
+            raise
+        finally:
+            await chunks.aclose()
+            if r is not None:
+                await r.aclose()
+        logger.info(f"SUCCESS: {name}")
+        if cached is None:
+            observe_download(source_mime, mime, size, time.perf_counter() - started)
+
+    return name, gen(), mime
+
+
+async def prefetch(jobs, fetch, ahead=PREFETCH_AHEAD, max_bytes=PREFETCH_MAX_BYTES):
+    # Fetch files ahead of the ZIP writer while keeping archive order: `jobs`
+    # is an async iterator of (prefix, job), fetch(job) returns (name,
+    # chunks, mime) and entries come out as (path, chunks, mime).
+    # Up to `ahead` files past the current one download into bounded queues,
+    # so memory stays near max_bytes while the archive is written in order.
+    per_file = max(1, max_bytes // DRIVE_CHUNK_SIZE // (ahead + 1))
+    pending = []
+
+    async def work(job, q):
+        name = None
+        try:
+            name, chunks, mime = await fetch(job)
+            await q.put((name, mime))
+            if name:
+                async for chunk in chunks:
+                    await q.put(chunk)
+        except Exception as e:
+            logger.exception(f"Prefetch failed for {job}")
+            # Before the head a failure just skips the file; after it the
+            # entry is open, so hand the error to drain() to fail the archive.
+            await q.put((None, None) if name is None else e)
+        await q.put(None)
+
+    async def drain(q):
+        while (chunk := await q.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    jobs = aiter(jobs)
+    exhausted = False
+    current = None
+
+    async def fill():
+        nonlocal exhausted
+        while not exhausted and len(pending) <= ahead:
+            try:
+                prefix, job = await anext(jobs)
+            except StopAsyncIteration:
+                exhausted = True
+                return
+            q = asyncio.Queue(maxsize=per_file)
+            pending.append((prefix, q, asyncio.create_task(work(job, q))))
+
+    try:
+        await fill()
+        while pending:
+            prefix, q, current = pending.pop(0)
+            head = await q.get()
+            if head is None or not head[0]:
+                await fill()
+                continue
+            name, mime = head
+            yield f"{prefix}/{name}", drain(q), mime
+            await fill()
+    finally:
+        # The client went away or the archive failed; stop the downloads.
+        for task in [current] + [task for _, _, task in pending]:
+            if task is not None:
+                task.cancel()
@@ -0,0 +1,184 @@
+import os
+import asyncio
+import logging
+
+from app import aio
+from app.cache import get_cache
+from app.classroom import LIST_WORKERS
+from app.drive import export_targets
+from app.ratelimit import RetryBudget
+
+logger = logging.getLogger(__name__)
+
+# Google files have no size until they are exported; split planning counts
+# this much per export target.
+EXPORT_SIZE_ESTIMATE = int(os.environ.get("EXPORT_SIZE_ESTIMATE", 2 * 1024 * 1024))
+
+
+async def cached_course_files_async(user, api, course_ids):
+    # Serve listings from the cache and list only the missing courses,
+    # still yielding (course_id, files) in the requested order.
+    cache = get_cache()
+    hits = {cid: cache.get(f"{user}:files:{cid}") for cid in course_ids}
+    limit = asyncio.Semaphore(LIST_WORKERS)
+
+    async def listing(cid):
+        async with limit:
+            return await aio.list_course_files(api, cid)
+
+    fresh = {
+        cid: asyncio.create_task(listing(cid))
+        for cid, files in hits.items() if files is None
+    }
+    try:
+        for cid in course_ids:
+            if hits[cid] is None:
+                files = await fresh[cid]
+                cache.set(f"{user}:files:{cid}", files)
+                hits[cid] = files
+            yield cid, hits[cid]
+    finally:
+        for task in fresh.values():
+            task.cancel()
+
+
+class ArchivePlan:
+    # A file attached to several courses is fetched once, under the first
+    # course it appears in; the other places are listed in DUPLICATES.txt.
+    # A Google file with several export formats becomes one job per format,
+    # all planned from the same metadata lookup.
+    # progress(event, **data), when given, hears about planned work and skips.
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.metadata = {}
+        self.first_prefix = {}
+        self.names = {}
+        self.duplicates = []
+
+    def unique(self, prefix, fids):
+        batch = []
+        for fid in fids:
+            if fid in self.first_prefix:
+                if self.first_prefix[fid] != prefix:
+                    self.duplicates.append((prefix, fid))
+                continue
+            self.first_prefix[fid] = prefix
+            for export in export_targets(self.metadata.get(fid)):
+                batch.append((prefix, (fid, export)))
+        if self.progress:
+            size = sum(int(self.metadata.get(fid, {}).get("size", 0)) for _, (fid, _) in batch)
+            self.progress("planned", files=len(batch), bytes=size)
+        return batch
+
+    def fetched(self, fid, name):
+        if name is None:
+            if self.progress:
+                self.progress("skip", file_id=fid, name=self.metadata.get(fid, {}).get("name", fid))
+            return
+        self.names.setdefault(fid, []).append(name)
+
+    def duplicates_entry(self):
+        if not self.duplicates:
+            return None
+        saved = sum(int(self.metadata.get(fid, {}).get("size", 0)) for _, fid in self.duplicates)
+        logger.info(f"DEDUPLICATED {len(self.duplicates)} files shared between courses ({saved / 1e6:.1f} MB not fetched again)")
+        lines = []
+        for prefix, fid in self.duplicates:
+            for name in sorted(self.names.get(fid, [])):
+                lines.append(f"{prefix}/{name} -> {self.first_prefix[fid]}/{name}\n")
+        return "DUPLICATES.txt", "".join(lines).encode(), "text/plain"
+
+
+async def archive_entries_async(creds, user, course_ids, file_ids, progress=None, part=None):
+    # Entries for stream_zip, built on the event loop: no thread is held
+    # while waiting on Google. `part`, from plan_parts_async, limits the
+    # archive to that part's files and reuses the metadata looked up then.
+    budget = RetryBudget()
+    api = aio.AsyncGoogle(creds, budget, user)
+    plan = ArchivePlan(progress)
+
+    async def jobs():
+        if part is not None:
+            logger.info(f"=== DOWNLOADING A PART OF {part['files']} FILES ===")
+            plan.metadata.update(part["metadata"])
+            for prefix, fids in part["groups"]:
+                await aio.fetch_metadata(api, fids, plan.metadata)
+                for job in plan.unique(prefix, fids):
+                    yield job
+        elif file_ids:
+            logger.info(f"=== DOWNLOADING {len(file_ids)} SELECTED FILES ===")
+            await aio.fetch_metadata(api, file_ids, plan.metadata)
+            for job in plan.unique("files", file_ids):
+                yield job
+        else:
+            logger.info(f"=== STARTING DOWNLOAD FOR {len(course_ids)} COURSES ===")
+            async for cid, files in cached_course_files_async(user, api, course_ids):
+                logger.info(f"Processing Course: {cid}")
+                await aio.fetch_metadata(api, [fid for fid, _ in files], plan.metadata)
+                for job in plan.unique(cid, [fid for fid, _ in files]):
+                    yield job
+
+    async def fetch(job):
+        fid, export = job
+        name, chunks, mime = await aio.stream_file(api, fid, meta=plan.metadata.get(fid), export=export)
+        plan.fetched(fid, name)
+        return name, chunks, mime
+
+    async for entry in aio.prefetch(jobs(), fetch):
+        yield entry
+    entry = plan.duplicates_entry()
+    if entry:
+        yield entry
+    logger.info(f"=== ZIP GENERATION COMPLETE ({budget.retries} API retries) ===")
+
+
+def estimated_size(meta):
+    targets = export_targets(meta)
+    if targets == [None]:
+        return int((meta or {}).get("size", 0))
+    return EXPORT_SIZE_ESTIMATE * len(targets)
+
+
+async def plan_parts_async(creds, user, course_ids, file_ids, part_bytes=None, per_course=False):
+    # Split a selection into archives of at most part_bytes (by Drive's
+    # sizes; a single larger file gets a part of its own) and/or one per
+    # course. Each part is a self-contained archive, so a file attached to
+    # courses that land in different parts is in each of them.
+    api = aio.AsyncGoogle(creds, RetryBudget(), user)
+    metadata = {}
+    parts = []
+
+    async def groups():
+        if file_ids:
+            yield "files", file_ids
+        else:
+            async for cid, files in cached_course_files_async(user, api, course_ids):
+                yield cid, [fid for fid, _ in files]
+
+    async for prefix, fids in groups():
+        fids = list(dict.fromkeys(fids))
+        await aio.fetch_metadata(api, fids, metadata)
+        new_group = True
+        for i, fid in enumerate(fids):
+            size = estimated_size(metadata.get(fid))
+            part = parts[-1] if parts else None
+            if (
+                part is None
+                or (per_course and i == 0)
+                or (part_bytes and part["files"] and part["bytes"] + size > part_bytes)
+            ):
+                part = {"groups": [], "files": 0, "bytes": 0, "metadata": {}}
+                parts.append(part)
+                new_group = True
+            if new_group:
+                part["groups"].append([prefix, []])
+                new_group = False
+            part["groups"][-1][1].append(fid)
+            part["files"] += 1
+            part["bytes"] += size
+            if fid in metadata:
+                part["metadata"][fid] = metadata[fid]
+
+    logger.info(f"=== PLANNED {len(parts)} PARTS FOR {sum(p['files'] for p in parts)} FILES ===")
+    return parts
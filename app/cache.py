@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+LISTING_CACHE_TTL = int(os.environ.get("LISTING_CACHE_TTL", 300))
+LISTING_CACHE_MAX_ENTRIES = int(os.environ.get("LISTING_CACHE_MAX_ENTRIES", 2048))
+# e.g. redis://localhost:6379/0 to share the cache between instances.
+LISTING_CACHE_URL = os.environ.get("LISTING_CACHE_URL")
+
+
+class MemoryCache:
+    def __init__(self, max_entries=LISTING_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=LISTING_CACHE_TTL):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+
+class RedisCache:
+    # Works with anything speaking the Redis protocol; eviction is left to
+    # the server's maxmemory-policy (allkeys-lru).
+    def __init__(self, url, namespace="gcd:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("LISTING_CACHE_URL is set but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.namespace = namespace
+
+    def get(self, key):
+        raw = self.client.get(self.namespace + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=LISTING_CACHE_TTL):
+        self.client.set(self.namespace + key, json.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.namespace + key)
+
+    def delete_prefix(self, prefix):
+        for key in self.client.scan_iter(match=self.namespace + prefix + "*"):
+            self.client.delete(key)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RedisCache(LISTING_CACHE_URL) if LISTING_CACHE_URL else MemoryCache()
+        return _cache
+
+
+def user_key(token):
+    # The refresh token outlives access-token refreshes, so it identifies
+    # the signed-in user without storing anything readable.
+    secret = token.get("refresh_token") or token.get("token") or ""
+    return hashlib.sha256(secret.encode()).hexdigest()[:32]
@@ -1,3 +1,16 @@
+import os
+
+# The API clamps pageSize to its own maximum, so ask for as much as it allows.
+PAGE_SIZE = 1000
+LIST_WORKERS = int(os.environ.get("CLASSROOM_LIST_WORKERS", 8))
+
+# Listing key -> fallback title for attachments
+LISTINGS = {
+    "courseWork": "Assignment",
+    "courseWorkMaterial": "Material",
+}
+
+
 def list_all_courses(classroom):
     courses = []
     page_token = None
@@ -14,47 +27,3 @@ def list_all_courses(classroom):
             break
 
     return courses
-
-
-def list_course_files(classroom, course_id):
-    files = []
-
-    # Coursework
-    token = None
-    while True:
-        resp = classroom.courses().courseWork().list(
-            courseId=course_id,
-            pageToken=token,
-        ).execute()
-
-        for cw in resp.get("courseWork", []):
-            title = cw.get("title", "Assignment")
-            for mat in cw.get("materials", []):
-                df = mat.get("driveFile", {}).get("driveFile")
-                if df and df.get("id"):
-                    files.append((df["id"], df.get("title", title)))
-
-        token = resp.get("nextPageToken")
-        if not token:
-            break
-
-    # Coursework materials
-    token = None
-    while True:
-        resp = classroom.courses().courseWorkMaterials().list(
-            courseId=course_id,
-            pageToken=token,
-        ).execute()
-
-        for m in resp.get("courseWorkMaterial", []):
-            title = m.get("title", "Material")
-            for mat in m.get("materials", []):
-                df = mat.get("driveFile", {}).get("driveFile")
-                if df and df.get("id"):
-                    files.append((df["id"], df.get("title", title)))
-
-        token = resp.get("nextPageToken")
-        if not token:
-            break
-
-    return files
@@ -4,12 +4,28 @@ import json
 import pathlib
 import re
 import argparse
-from typing import Dict, Set, List, Tuple
+import atexit
+import hashlib
+import http.cookiejar
+import random
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Set, List, Optional, Tuple
 
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+import requests
+from requests.adapters import HTTPAdapter
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
 
 # ---- SCOPES ----
@@ -27,7 +43,8 @@ SCOPES = [
 
 
 TOKEN_FILE = "token.json"
-INDEX_FILE = "download_index.json"
+INDEX_FILE = "download_index.sqlite3"
+LEGACY_INDEX_FILE = "download_index.json"
 
 
 # ---------- AUTH HELPERS ----------
@@ -57,6 +74,183 @@ def get_credentials() -> Credentials:
     return creds
 
 
+# ---------- HTTP TRANSPORT ----------
+
+HTTP_TIMEOUT = 120
+MAX_RETRIES = 6
+RETRY_BUDGET = 500
+BACKOFF_MAX = 32.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"userRateLimitExceeded", "rateLimitExceeded"}
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all worker threads. Halves its rate on every
+    quota error and creeps back towards `max_rate` on success.
+    """
+
+    def __init__(self, max_rate: float, min_rate: float = 1.0):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.tokens = max_rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, self.rate)
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+
+def is_rate_limited(status: int, content: bytes) -> bool:
+    if status in RETRY_STATUSES:
+        return True
+    if status != 403:
+        return False
+    # 403 is also used for real permission errors; only retry quota reasons.
+    try:
+        errors = json.loads(content)["error"].get("errors", [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+    return any(e.get("reason") in RATE_LIMIT_REASONS for e in errors)
+
+
+def backoff_delay(attempt: int, retry_after: str = None) -> float:
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            pass
+    delay = min(BACKOFF_MAX, 2.0 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class PooledResponse(dict):
+    """
+    Response shaped like httplib2.Response, which is what googleapiclient expects.
+    """
+
+    def __init__(self, r, content):
+        super().__init__((k.lower(), v) for k, v in r.headers.items())
+        self.status = r.status_code
+        self.reason = r.reason
+        self["status"] = str(r.status_code)
+        if "content-encoding" in self:
+            # requests already decoded the body; report the decoded length.
+            self["-content-encoding"] = self.pop("content-encoding")
+            self["content-length"] = str(len(content))
+
+
+class PooledHttp:
+    """
+    httplib2-compatible transport backed by one requests.Session, so every
+    service and worker thread reuses the same keep-alive connections.
+    Calls are rate limited and retried with jittered exponential backoff on
+    429/5xx, rate-limit 403s and connection errors.
+    """
+
+    def __init__(self, credentials: Credentials, pool_size: int = 10, max_rate: float = 10.0):
+        self.credentials = credentials
+        self.limiter = RateLimiter(max_rate)
+        self.retries = 0
+        self.retry_budget = RETRY_BUDGET
+        self._retry_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self._auth_request = Request(self.session)
+
+    def _send(self, uri, method, body, headers):
+        signed = dict(headers)
+        self.credentials.before_request(self._auth_request, method, uri, signed)
+        return self.session.request(
+            method, uri, data=body, headers=signed, timeout=HTTP_TIMEOUT
+        )
+
+    def _send_once(self, uri, method, body, headers):
+        r = self._send(uri, method, body, headers)
+
+        if r.status_code == 401 and self.credentials.refresh_token:
+            self.credentials.refresh(self._auth_request)
+            r = self._send(uri, method, body, headers)
+
+        return r
+
+    def _retry(self, attempt: int) -> bool:
+        with self._retry_lock:
+            if attempt >= MAX_RETRIES or self.retry_budget <= 0:
+                return False
+            self.retry_budget -= 1
+            self.retries += 1
+            return True
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        headers = headers or {}
+        attempt = 0
+        # A download is fetched as a run of Range requests; only its first
+        # one counts as an API call.
+        charged = headers.get("range", "bytes=0-").startswith("bytes=0-")
+
+        while True:
+            if charged:
+                self.limiter.acquire()
+            try:
+                r = self._send_once(uri, method, body, headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not self._retry(attempt):
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"Retrying after connection error ({e}), waiting {delay:.1f}s")
+            else:
+                content = r.content
+                if not is_rate_limited(r.status_code, content):
+                    self.limiter.succeeded()
+                    return PooledResponse(r, content), content
+                self.limiter.throttled()
+                if not self._retry(attempt):
+                    return PooledResponse(r, content), content
+                delay = backoff_delay(attempt, r.headers.get("Retry-After"))
+                print(f"Rate limited ({r.status_code}), retrying in {delay:.1f}s")
+
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        pass
+
+    def reuse_stats(self) -> Tuple[int, int]:
+        """
+        Return (requests sent, connections opened) across all hosts.
+        """
+        pools = self.session.get_adapter("https://").poolmanager.pools
+        sent = opened = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                sent += pool.num_requests
+                opened += pool.num_connections
+        return sent, opened
+
+
 # ---------- UTILS ----------
 
 def safe_filename(name: str) -> str:
@@ -72,22 +266,378 @@ def safe_filename(name: str) -> str:
     return name
 
 
-def load_index() -> Set[str]:
-
-    if not os.path.exists(INDEX_FILE):
-        return set()
-    try:
-        with open(INDEX_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return set(data.get("downloaded_ids", []))
-    except Exception:
-        # If corrupted, ignore
-        return set()
+class Stats:
+    """
+    Per-stage timings and counters for --stats, summarised at the end of
+    the run so it is clear which stage dominates.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+        self.counts: Dict[str, int] = {}
+
+    def observe(self, stage: str, value: float) -> None:
+        with self._lock:
+            self.samples.setdefault(stage, []).append(value)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def report(self) -> str:
+        with self._lock:
+            width = max(map(len, [*self.samples, *self.counts, "stage"])) + 2
+            lines = [f"{'stage':<{width}}{'n':>6}{'total':>10}{'p50':>9}{'p95':>9}{'max':>9}"]
+            for stage, values in sorted(self.samples.items()):
+                values = sorted(values)
+                p50 = values[len(values) // 2]
+                p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+                lines.append(
+                    f"{stage:<{width}}{len(values):>6}{sum(values):>10.2f}"
+                    f"{p50:>9.2f}{p95:>9.2f}{values[-1]:>9.2f}"
+                )
+            for name, n in sorted(self.counts.items()):
+                lines.append(f"{name:<{width}}{n:>6}")
+        return "\n".join(lines)
+
+STATS = Stats()
+
+
+class Profiler:
+    """
+    Opt-in profile for --profile: samples every thread's stack into a
+    speedscope file (open it at https://www.speedscope.app) and keeps the
+    tracemalloc snapshot taken nearest to peak memory. Nothing runs unless
+    --profile is given.
+    """
+
+    def __init__(self, name: str, directory: str, interval: float = 0.005):
+        self.name = name
+        self.directory = directory
+        self.interval = interval
+        self.frames: List[Dict] = []
+        self._frame_ids: Dict[Tuple, int] = {}
+        # thread id -> [thread name, stacks, weights]; identical consecutive
+        # samples are merged into one weight
+        self.threads: Dict[int, List] = {}
+        self.peak = 0
+        self.snapshot = None
+        self._snapshot_size = 0
+        self._snapshot_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self.prefix = None
+
+    def start(self) -> "Profiler":
+        tracemalloc.start()
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        """
+        Write <directory>/<timestamp>-<name>.speedscope.json, .tracemalloc
+        and .tracemalloc.txt, and return that path prefix.
+        """
+        if self.prefix is not None:
+            return self.prefix
+        self._stop.set()
+        self._thread.join()
+        self._take_snapshot()
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        elapsed = time.perf_counter() - self.started
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.prefix = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.name}")
+        profiles = [
+            {
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": stacks,
+                "weights": weights,
+            }
+            for thread_name, stacks, weights in self.threads.values()
+        ]
+        with open(self.prefix + ".speedscope.json", "w") as f:
+            json.dump(
+                {
+                    "$schema": "https://www.speedscope.app/file-format-schema.json",
+                    "name": self.name,
+                    "exporter": "classroom-downloader",
+                    "shared": {"frames": self.frames},
+                    "profiles": profiles,
+                },
+                f,
+            )
 
+        lines = [f"{self.name}: {elapsed:.1f}s, peak traced memory {self.peak / 1e6:.1f} MB"]
+        if self.snapshot is not None:
+            self.snapshot.dump(self.prefix + ".tracemalloc")
+            lines.append(f"Top allocations in the largest snapshot ({self._snapshot_size / 1e6:.1f} MB):")
+            lines.extend(str(stat) for stat in self.snapshot.statistics("lineno")[:30])
+        with open(self.prefix + ".tracemalloc.txt", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return self.prefix
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if name != "profiler":
+                    self._record(ident, name, frame, now - last)
+            last = now
+
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            # Snapshots walk every live allocation: take one only after
+            # 10% growth, at most once a second.
+            if current > self._snapshot_size * 1.1 and now - self._snapshot_at >= 1:
+                self._take_snapshot()
+
+    def _record(self, ident: int, thread_name: str, frame, weight: float) -> None:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self._frame_ids.get(key)
+            if index is None:
+                index = self._frame_ids[key] = len(self.frames)
+                self.frames.append({"name": key[0], "file": key[1], "line": key[2]})
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+
+        _, stacks, weights = self.threads.setdefault(ident, [thread_name, [], []])
+        if stacks and stacks[-1] == stack:
+            weights[-1] += weight
+        else:
+            stacks.append(stack)
+            weights.append(weight)
+
+    def _take_snapshot(self) -> None:
+        current = tracemalloc.get_traced_memory()[0]
+        if current <= self._snapshot_size:
+            return
+        self.snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        self._snapshot_size = current
+        self._snapshot_at = time.perf_counter()
+
+
+class DownloadIndex:
+    """
+    SQLite-backed record of downloaded Drive files. Each completed file is
+    committed on its own, so an interrupted run keeps its progress, and
+    membership checks hit the primary key instead of loading every id.
+    """
+
+    def __init__(self, path: str = INDEX_FILE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                file_id TEXT PRIMARY KEY,
+                size INTEGER,
+                md5 TEXT,
+                modified_time TEXT,
+                path TEXT,
+                downloaded_at REAL,
+                mime_type TEXT,
+                exports TEXT
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}
+        for column in ("mime_type", "exports"):
+            if column not in columns:
+                # Indexes written before export formats were recorded.
+                self._conn.execute(f"ALTER TABLE files ADD COLUMN {column} TEXT")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS courses (
+                course_id TEXT PRIMARY KEY,
+                watermark TEXT
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS course_files (
+                course_id TEXT,
+                file_id TEXT,
+                name_hint TEXT,
+                PRIMARY KEY (course_id, file_id)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def __contains__(self, file_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM files WHERE file_id = ?", (file_id,)
+            ).fetchone()
+        return row is not None
+
+    def downloaded_under(self, file_id: str, base_dir: pathlib.Path) -> bool:
+        """
+        True if every export_targets() copy of the file was downloaded into
+        base_dir. The index is shared by every --base-dir, so a copy saved
+        elsewhere doesn't count, and neither does one made before its type
+        gained another export format.
+        """
+        record = self.get(file_id)
+        if record is None:
+            return False
+        if record["path"] is None:
+            # Imported from the old JSON index, which kept no paths.
+            return True
+        if not pathlib.Path(record["path"]).resolve().is_relative_to(base_dir.resolve()):
+            return False
+        if record["exports"] is None:
+            # Recorded before export formats were; the targets are checked
+            # on disk once and the row filled in.
+            return False
+        wanted = {ext for _, ext in export_targets(record["mime_type"])}
+        return wanted <= set(record["exports"].split(","))
+
+    def get(self, file_id: str) -> Dict:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, md5, modified_time, path, mime_type, exports FROM files WHERE file_id = ?",
+                (file_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("size", "md5", "modified_time", "path", "mime_type", "exports"), row))
+
+    def is_current(self, file_id: str, meta: Dict) -> bool:
+        """
+        True if the recorded copy matches Drive's md5Checksum (binary files)
+        or modifiedTime (Google Docs, which have no checksum).
+        """
+        record = self.get(file_id)
+        if record is None:
+            return False
+        if record["md5"] is None and record["modified_time"] is None:
+            # Imported from the old JSON index; nothing to compare against,
+            # so trust it and start tracking from here.
+            self.add(
+                file_id,
+                size=record["size"],
+                md5=meta.get("md5Checksum"),
+                modified_time=meta.get("modifiedTime"),
+                path=record["path"],
+                mime_type=record["mime_type"],
+                exports=record["exports"],
+            )
+            return True
+        if meta.get("md5Checksum"):
+            return record["md5"] == meta["md5Checksum"]
+        return record["modified_time"] == meta.get("modifiedTime")
+
+    def course_watermark(self, course_id: str) -> str:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT watermark FROM courses WHERE course_id = ?", (course_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def course_files(self, course_id: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT file_id, name_hint FROM course_files WHERE course_id = ?",
+                (course_id,),
+            ).fetchall()
+
+    def set_course(self, course_id: str, watermark: str, files: List[Tuple[str, str]]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO courses VALUES (?, ?)", (course_id, watermark)
+            )
+            self._conn.execute("DELETE FROM course_files WHERE course_id = ?", (course_id,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO course_files VALUES (?, ?, ?)",
+                [(course_id, fid, hint) for fid, hint in files],
+            )
+            self._conn.commit()
+
+    def add(
+        self,
+        file_id: str,
+        size: int = None,
+        md5: str = None,
+        modified_time: str = None,
+        path: str = None,
+        mime_type: str = None,
+        exports: List[str] = None,
+    ) -> None:
+        """
+        `exports` lists the extensions of the copies now on disk ("" for a
+        file saved as is).
+        """
+        if isinstance(exports, list):
+            exports = ",".join(exports)
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO files
+                    (file_id, size, md5, modified_time, path, downloaded_at, mime_type, exports)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (file_id, size, md5, modified_time, path, time.time(), mime_type, exports),
+            )
+            self._conn.commit()
 
-def save_index(downloaded_ids: Set[str]) -> None:
-    with open(INDEX_FILE, "w", encoding="utf-8") as f:
-        json.dump({"downloaded_ids": sorted(downloaded_ids)}, f, indent=2)
+    def import_ids(self, file_ids: List[str]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO files (file_id) VALUES (?)",
+                [(fid,) for fid in file_ids],
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def load_index() -> DownloadIndex:
+    """
+    Open the download index, importing ids from the old JSON index once.
+    """
+    index = DownloadIndex(INDEX_FILE)
+    if os.path.exists(LEGACY_INDEX_FILE):
+        try:
+            with open(LEGACY_INDEX_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            index.import_ids(data.get("downloaded_ids", []))
+            os.replace(LEGACY_INDEX_FILE, LEGACY_INDEX_FILE + ".migrated")
+        except Exception:
+            # If corrupted, ignore
+            pass
+    return index
 
 def color_status(status: str) -> str:
     if status == "ACTIVE":
@@ -170,109 +720,768 @@ def list_course_files(classroom_service, course_id: str) -> List[Tuple[str, str]
     return files
 
 
+def course_watermark(classroom_service, course: Dict) -> str:
+    """
+    Fingerprint of a course's content: its own updateTime plus the newest
+    coursework and material updateTime (two single-item list calls).
+    """
+    parts = [course.get("updateTime", "")]
+    for resource, key in (
+        (classroom_service.courses().courseWork(), "courseWork"),
+        (classroom_service.courses().courseWorkMaterials(), "courseWorkMaterial"),
+    ):
+        resp = resource.list(
+            courseId=course["id"],
+            orderBy="updateTime desc",
+            pageSize=1,
+            fields=f"{key}(updateTime)",
+        ).execute()
+        items = resp.get(key, [])
+        parts.append(items[0].get("updateTime", "") if items else "")
+    return "|".join(parts)
+
+
 # ---------- DRIVE DOWNLOAD HELPERS ----------
 
+EXPORT_MIME_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".odt": "application/vnd.oasis.opendocument.text",
+    ".txt": "text/plain",
+    ".epub": "application/epub+zip",
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    ".odp": "application/vnd.oasis.opendocument.presentation",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".ods": "application/vnd.oasis.opendocument.spreadsheet",
+    ".csv": "text/csv",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".svg": "image/svg+xml",
+}
+
+# Google file type -> [(export MIME type, extension)]; a file is saved once
+# per target. Override with --export-formats.
 GOOGLE_DOC_TYPES = {
-    "application/vnd.google-apps.document": (  # Docs
-        "application/pdf",
-        ".pdf",
-    ),
-    "application/vnd.google-apps.presentation": (  # Slides
-        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
-        ".pptx",
-    ),
-    "application/vnd.google-apps.spreadsheet": (  # Sheets
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        ".xlsx",
-    ),
+    "application/vnd.google-apps.document": [  # Docs
+        ("application/pdf", ".pdf"),
+    ],
+    "application/vnd.google-apps.presentation": [  # Slides
+        ("application/pdf", ".pdf"),
+        ("application/vnd.openxmlformats-officedocument.presentationml.presentation", ".pptx"),
+    ],
+    "application/vnd.google-apps.spreadsheet": [  # Sheets
+        ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+    ],
+    "application/vnd.google-apps.drawing": [  # Drawings
+        ("image/png", ".png"),
+    ],
+    "application/vnd.google-apps.jam": [  # Jamboards
+        ("application/pdf", ".pdf"),
+    ],
 }
 
 
+def parse_export_formats(spec: str) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Parse --export-formats, e.g. "presentation=pdf,pptx;spreadsheet=xlsx,csv",
+    into GOOGLE_DOC_TYPES entries.
+    """
+    formats = {}
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        kind, _, exts = part.partition("=")
+        targets = []
+        for ext in filter(None, (e.strip().lower() for e in exts.split(","))):
+            ext = "." + ext.lstrip(".")
+            if ext not in EXPORT_MIME_TYPES:
+                raise argparse.ArgumentTypeError(
+                    f"unknown export format {ext!r}, expected one of {', '.join(EXPORT_MIME_TYPES)}"
+                )
+            targets.append((EXPORT_MIME_TYPES[ext], ext))
+        if not targets:
+            raise argparse.ArgumentTypeError(f"no export formats given for {kind!r}")
+        formats[f"application/vnd.google-apps.{kind.strip()}"] = targets
+    return formats
+
+
+def export_targets(mime_type: str) -> List[Tuple[Optional[str], str]]:
+    """
+    (export MIME type, extension) for each local copy of a Drive file: one
+    per GOOGLE_DOC_TYPES target, or (None, "") for a file saved as is.
+    """
+    return GOOGLE_DOC_TYPES.get(mime_type) or [(None, "")]
+
+
+# Drive accepts at most 100 calls in one batch request.
+METADATA_BATCH_SIZE = 100
+METADATA_FIELDS = "id,name,mimeType,size,md5Checksum,modifiedTime"
+
+
+def fetch_drive_metadata(
+    drive_service,
+    file_ids: List[str],
+    cache: Dict[str, Dict],
+) -> Dict[str, Dict]:
+    """
+    Look up metadata for many files with batched files.get calls, skipping
+    ids already in `cache`. Failed lookups are left out of the cache.
+    """
+    missing = [fid for fid in dict.fromkeys(file_ids) if fid not in cache]
+
+    def store(request_id, response, exception):
+        if exception is None:
+            cache[request_id] = response
+
+    for i in range(0, len(missing), METADATA_BATCH_SIZE):
+        batch = drive_service.new_batch_http_request(callback=store)
+        for fid in missing[i:i + METADATA_BATCH_SIZE]:
+            batch.add(
+                drive_service.files().get(fileId=fid, fields=METADATA_FIELDS),
+                request_id=fid,
+            )
+        with STATS.timer("drive metadata, per batch (s)"):
+            batch.execute()
+
+    return cache
+
+
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def part_file(dest_path: pathlib.Path, version: str = None) -> pathlib.Path:
+    """
+    The .part file that a download of this version of a Drive file (its
+    md5Checksum or modifiedTime) resumes from. Parts left by other versions
+    are deleted: appending to one would splice two different files.
+    """
+    name = dest_path.name
+    if version:
+        name += "." + hashlib.sha1(version.encode()).hexdigest()[:12]
+    part_path = dest_path.with_name(name + ".part")
+
+    pattern = re.compile(re.escape(dest_path.name) + r"(\.[0-9a-f]{12})?\.part")
+    for p in dest_path.parent.iterdir():
+        if p != part_path and pattern.fullmatch(p.name):
+            p.unlink(missing_ok=True)
+    return part_path
+
+
+def download_ranged(request, part_path: pathlib.Path, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    """
+    Append the media behind `request` to part_path with HTTP Range requests,
+    starting from whatever is already on disk. Returns an md5 of the whole file.
+    """
+    md5 = hashlib.md5()
+    offset = 0
+    if part_path.exists():
+        with open(part_path, "rb") as fh:
+            for block in iter(lambda: fh.read(chunk_size), b""):
+                md5.update(block)
+                offset += len(block)
+        if offset:
+            print(f"Resuming {part_path.name} from {offset / 1e6:.1f} MB")
+
+    with open(part_path, "ab") as fh:
+        total = None
+        while total is None or offset < total:
+            headers = dict(request.headers)
+            headers["range"] = f"bytes={offset}-{offset + chunk_size - 1}"
+            resp, content = request.http.request(request.uri, "GET", headers=headers)
+
+            if resp.status == 416:
+                # Nothing left past `offset`: the part file is already complete.
+                break
+            if resp.status not in (200, 206):
+                raise HttpError(resp, content, uri=request.uri)
+
+            if resp.status == 200:
+                # Range ignored; the body is the whole file.
+                fh.seek(0)
+                fh.truncate()
+                md5 = hashlib.md5()
+                offset = 0
+                total = len(content)
+            else:
+                total = int(resp["content-range"].rsplit("/", 1)[1])
+
+            fh.write(content)
+            md5.update(content)
+            offset += len(content)
+            if not content:
+                break
+
+    return md5
+
+
+FICLONE = 0x40049409  # Linux ioctl for copy-on-write clones (btrfs, XFS)
+
+
+def place_file(src: pathlib.Path, dest: pathlib.Path) -> None:
+    """
+    Make dest a copy of src as cheaply as the filesystem allows:
+    a reflink, then a hardlink, then a plain copy.
+    """
+    try:
+        import fcntl
+
+        with open(src, "rb") as s, open(dest, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return
+    except (ImportError, OSError):
+        if dest.exists():
+            dest.unlink()
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+class BlobCache:
+    """
+    Content-addressed store of downloaded files, shared by every run and
+    --base-dir that points at the same --cache-dir. Blobs are keyed by file
+    id + md5Checksum (or modifiedTime and export format for Google Docs,
+    whose exports are the slowest Drive call), so a changed file is never
+    served stale. The least recently used blobs are evicted once
+    the cache grows past max_bytes.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.hit_bytes = 0
+        self._lock = threading.Lock()
+        self._total = sum(p.stat().st_size for p in self._blobs())
+
+    @staticmethod
+    def key(file_id: str, version: str, mime_type: str) -> Optional[str]:
+        if not version:
+            return None
+        raw = f"{file_id}\0{version}\0{mime_type or ''}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / key[:2] / key
+
+    def _blobs(self) -> List[pathlib.Path]:
+        return [p for p in self.root.glob("??/*") if not p.name.endswith(".tmp")]
+
+    def fetch(self, key: str, dest: pathlib.Path, size: int = None) -> bool:
+        """
+        Materialize the blob for `key` at dest. False on a miss.
+        """
+        blob = self._path(key)
+        try:
+            blob_size = blob.stat().st_size
+        except FileNotFoundError:
+            return False
+        if size is not None and blob_size != int(size):
+            # A hardlinked copy was edited in place; don't hand it out again.
+            blob.unlink(missing_ok=True)
+            return False
+        os.utime(blob)  # mtime doubles as the LRU clock
+        place_file(blob, dest)
+        with self._lock:
+            self.hits += 1
+            self.hit_bytes += blob_size
+        return True
+
+    def store(self, key: str, path: pathlib.Path) -> None:
+        blob = self._path(key)
+        blob.parent.mkdir(exist_ok=True)
+        tmp = blob.with_name(f"{blob.name}.{threading.get_ident()}.tmp")
+        place_file(path, tmp)
+        os.replace(tmp, blob)
+        with self._lock:
+            self._total += blob.stat().st_size
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        blobs = []
+        for p in self._blobs():
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((st.st_mtime, st.st_size, p))
+        blobs.sort()
+        self._total = sum(size for _, size, _ in blobs)
+        for _, size, p in blobs:
+            if self._total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            self._total -= size
+
+
 def download_drive_file(
     drive_service,
     file_id: str,
     dest_path: pathlib.Path,
     mime_type: str,
     dry_run: bool = False,
-) -> None:
-
+    size: int = None,
+    md5: str = None,
+    modified_time: str = None,
+    cache: BlobCache = None,
+    export_mime: str = None,
+) -> int:
+    """
+    Download a Drive file to dest_path and return the number of bytes written.
+    With `export_mime`, Google Docs / Sheets / Slides are exported to that
+    format via files.export.
+    Binary files are written to a .part file that later runs resume from
+    (while Drive still has the same version), checked against Drive's
+    size / md5Checksum, then renamed into place.
+    With a `cache`, a copy stored by an earlier download is used instead.
+    """
     dest_path.parent.mkdir(parents=True, exist_ok=True)
 
     if dry_run:
         print(f"[DRY RUN] Would download: {file_id} -> {dest_path}")
-        return
-
-    if mime_type in GOOGLE_DOC_TYPES:
-        export_mime, _ext = GOOGLE_DOC_TYPES[mime_type]
+        return 0
+
+    part_path = part_file(dest_path, md5 or modified_time)
+    # Exports are cached per target format, so changing GOOGLE_DOC_TYPES
+    # never serves an old rendering.
+    key = cache.key(file_id, md5 or modified_time, export_mime or mime_type) if cache else None
+
+    if key:
+        # Fetched beside the .part file, which a miss still resumes from.
+        cached_path = dest_path.with_name(dest_path.name + ".cached")
+        cached_path.unlink(missing_ok=True)
+        if cache.fetch(key, cached_path, None if export_mime else size):
+            os.replace(cached_path, dest_path)
+            part_path.unlink(missing_ok=True)
+            STATS.count("served from --cache-dir")
+            print(f"From cache: {dest_path}")
+            return dest_path.stat().st_size
+
+    started = time.perf_counter()
+    if export_mime:
+        # Exports are rendered on request and can't be resumed.
         request = drive_service.files().export_media(
             fileId=file_id, mimeType=export_mime
         )
+        with io.FileIO(part_path, "wb") as fh:
+            downloader = MediaIoBaseDownload(fh, request)
+
+            done = False
+            while not done:
+                status, done = downloader.next_chunk()
+        STATS.observe(f"export {mime_type} (s)", time.perf_counter() - started)
     else:
         request = drive_service.files().get_media(fileId=file_id)
+        resumed = part_path.exists()
+        digest = download_ranged(request, part_path)
+
+        def matches():
+            written = part_path.stat().st_size
+            return (size is None or written == int(size)) and (not md5 or digest.hexdigest() == md5)
+
+        if resumed and not matches():
+            # The bytes kept from an earlier run were bad; start over once.
+            print(f"Resumed {part_path.name} does not match Drive; downloading it again")
+            part_path.unlink()
+            digest = download_ranged(request, part_path)
+
+        written = part_path.stat().st_size
+        if not matches():
+            part_path.unlink()
+            raise RuntimeError(
+                f"Downloaded {dest_path} does not match Drive's size/checksum; "
+                "discarded it, run again to retry."
+            )
+        elapsed = time.perf_counter() - started
+        STATS.observe(f"download {mime_type} (MB/s)", written / 1e6 / max(elapsed, 1e-6))
 
-    fh = io.FileIO(dest_path, "wb")
-    downloader = MediaIoBaseDownload(fh, request)
-
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
+    os.replace(part_path, dest_path)
+    if key:
+        cache.store(key, dest_path)
 
     print(f"Downloaded: {dest_path}")
+    return dest_path.stat().st_size
 
 
-def ensure_extension(name: str, mime_type: str) -> str:
-    if mime_type in GOOGLE_DOC_TYPES:
-        export_mime, ext = GOOGLE_DOC_TYPES[mime_type]
-        if not name.lower().endswith(ext):
-            name = name + ext
+def ensure_extension(name: str, ext: str) -> str:
+    if ext and not name.lower().endswith(ext):
+        name = name + ext
     return name
 
 
 # ---------- CORE LOGIC ----------
 
-def download_all_for_course(
+_claim_lock = threading.Lock()
+
+
+class SharedFiles:
+    """
+    Drive files fetched during this run. When the same file is attached to
+    several courses it is downloaded once and hardlinked (or copied, where
+    links aren't supported) into the other course folders.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done: Dict[str, threading.Event] = {}
+        self._paths: Dict[str, List[pathlib.Path]] = {}
+        self.linked = 0
+        self.saved_bytes = 0
+
+    def __contains__(self, file_id: str) -> bool:
+        with self._lock:
+            return file_id in self._done
+
+    def claim(self, file_id: str) -> bool:
+        """
+        True if the caller is the first to fetch `file_id` and must call finish().
+        """
+        with self._lock:
+            if file_id in self._done:
+                return False
+            self._done[file_id] = threading.Event()
+            return True
+
+    def finish(self, file_id: str, paths: List[pathlib.Path] = None) -> None:
+        with self._lock:
+            if paths is not None:
+                self._paths[file_id] = paths
+            self._done[file_id].set()
+
+    def source(self, file_id: str) -> List[pathlib.Path]:
+        """
+        Wait for the first fetch of `file_id` and return where it was saved,
+        one path per export_targets() entry (None if it failed).
+        """
+        with self._lock:
+            done = self._done[file_id]
+        done.wait()
+        with self._lock:
+            return self._paths.get(file_id)
+
+    def link(self, source: pathlib.Path, dest_path: pathlib.Path) -> None:
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        if dest_path.exists():
+            dest_path.unlink()
+        try:
+            os.link(source, dest_path)
+        except OSError:
+            shutil.copy2(source, dest_path)
+        with self._lock:
+            self.linked += 1
+            self.saved_bytes += dest_path.stat().st_size
+
+
+def download_course_file(
+    drive_service,
+    file_id: str,
+    name_hint: str,
+    course_dir: pathlib.Path,
+    downloaded_ids: "DownloadIndex",
+    claimed_paths: Set[pathlib.Path],
+    meta: Dict = None,
+    replace: bool = False,
+    shared: SharedFiles = None,
+    cache: BlobCache = None,
+    dry_run: bool = False,
+    spawn: Callable = None,
+) -> int:
+    """
+    Resolve a single Classroom attachment to a local path and download it,
+    one copy per export target that isn't on disk yet.
+    With `replace`, an existing local copy is overwritten (it changed on Drive).
+    If `shared` already holds this file from another course, it is linked
+    instead of downloaded again.
+    spawn(fn), when given, runs fn on a free download slot and returns its
+    Future, or None if every slot is busy; further export formats of the
+    file render side by side through it, and in this thread otherwise.
+    Returns the number of bytes written (0 if skipped or linked).
+    """
+    if meta is None:
+        # Not resolved by the batch lookup; ask Drive directly.
+        meta = drive_service.files().get(
+            fileId=file_id,
+            fields=METADATA_FIELDS,
+        ).execute()
+
+    fname = meta.get("name") or name_hint or file_id
+    mime_type = meta.get("mimeType")
+
+    fname = safe_filename(fname)
+    targets = [
+        (export_mime, course_dir / ensure_extension(fname, ext))
+        for export_mime, ext in export_targets(mime_type)
+    ]
+
+    # Parallel workers may resolve two attachments to the same name.
+    pending = []
+    with _claim_lock:
+        for export_mime, dest_path in targets:
+            taken = dest_path in claimed_paths or (dest_path.exists() and not replace)
+            claimed_paths.add(dest_path)
+            if taken:
+                print(f"File already exists locally, skipping: {dest_path}")
+                STATS.count("skipped, already on disk")
+            else:
+                pending.append((export_mime, dest_path))
+
+    exports = [ext for _, ext in export_targets(mime_type)]
+    if not pending:
+        # Still mark ID as downloaded so we don't try again next time.
+        if not dry_run:
+            downloaded_ids.add(
+                file_id,
+                md5=meta.get("md5Checksum"),
+                modified_time=meta.get("modifiedTime"),
+                path=str(targets[0][1]),
+                mime_type=mime_type,
+                exports=exports,
+            )
+        return 0
+
+    owner = shared is None or shared.claim(file_id)
+    if not owner:
+        sources = dict(zip((path for _, path in targets), shared.source(file_id) or []))
+        if sources and dry_run:
+            for _, dest_path in pending:
+                print(f"[DRY RUN] Would link: {dest_path} -> {sources[dest_path]}")
+            return 0
+        if sources and all(sources[dest_path].exists() for _, dest_path in pending):
+            for _, dest_path in pending:
+                shared.link(sources[dest_path], dest_path)
+                STATS.count("linked from another course")
+                print(f"Linked: {dest_path} (same Drive file as {sources[dest_path]})")
+            return 0
+        # The first copy failed; fetch it here instead.
+
+    if replace:
+        print(f"Changed on Drive, downloading again: {targets[0][1]}")
+
+    def fetch(target):
+        export_mime, dest_path = target
+        return download_drive_file(
+            drive_service, file_id, dest_path, mime_type, dry_run=dry_run,
+            size=meta.get("size"), md5=meta.get("md5Checksum"),
+            modified_time=meta.get("modifiedTime"), cache=cache,
+            export_mime=export_mime,
+        )
+
+    # Several export formats of one file render side by side where the
+    # --workers limits leave room. The requests share the thread-safe
+    # PooledHttp behind drive_service.
+    futures = []
+    local = []
+    for target in pending[1:]:
+        future = spawn(lambda target=target: fetch(target)) if spawn else None
+        if future is None:
+            local.append(target)
+        else:
+            futures.append(future)
+    try:
+        try:
+            written = sum(fetch(target) for target in [pending[0]] + local)
+        finally:
+            wait(futures)
+        written += sum(future.result() for future in futures)
+    except BaseException:
+        if owner and shared is not None:
+            shared.finish(file_id)
+        raise
+    if owner and shared is not None:
+        shared.finish(file_id, [path for _, path in targets])
+
+    if not dry_run:
+        downloaded_ids.add(
+            file_id,
+            size=written,
+            md5=meta.get("md5Checksum"),
+            modified_time=meta.get("modifiedTime"),
+            path=str(targets[0][1]),
+            mime_type=mime_type,
+            exports=exports,
+        )
+    return written
+
+
+def list_course_downloads(
     classroom_service,
     drive_service,
     course: Dict,
     base_dir: pathlib.Path,
-    downloaded_ids: Set[str],
+    downloaded_ids: "DownloadIndex",
+    metadata: Dict[str, Dict],
+    sync: bool = False,
+    shared: SharedFiles = None,
     dry_run: bool = False,
-) -> None:
+) -> List[Tuple[str, str, pathlib.Path, Dict, bool]]:
+    """
+    List the (file_id, name_hint, course_dir, meta, replace) attachments of a
+    course that need downloading, resolving Drive metadata in batches.
+
+    Without `sync`, anything already downloaded into base_dir in every
+    export format is skipped, except files fetched earlier in this run (so
+    they get linked here too). With `sync`, the course is only re-listed if
+    its watermark moved, and every known file is re-checked against Drive's
+    checksum / modifiedTime.
+    """
     course_name = course.get("name", f"course_{course.get('id')}")
     course_dir = base_dir / safe_filename(course_name)
 
     print(f"\n=== Course: {course_name} (id={course.get('id')}) ===")
 
-    files = list_course_files(classroom_service, course["id"])
-    print(f"Found {len(files)} attached Drive files in this course.")
+    if not sync:
+        with STATS.timer("classroom list, per course (s)"):
+            files = list_course_files(classroom_service, course["id"])
+        print(f"Found {len(files)} attached Drive files in this course.")
+
+        pending = [
+            (fid, hint) for fid, hint in files
+            if not downloaded_ids.downloaded_under(fid, base_dir) or (shared is not None and fid in shared)
+        ]
+        fetch_drive_metadata(drive_service, [fid for fid, _ in pending], metadata)
+
+        return [
+            (file_id, name_hint, course_dir, metadata.get(file_id), False)
+            for file_id, name_hint in pending
+        ]
+
+    watermark = course_watermark(classroom_service, course)
+    if watermark == downloaded_ids.course_watermark(course["id"]):
+        files = downloaded_ids.course_files(course["id"])
+        print(f"Course unchanged; checking {len(files)} known Drive files.")
+    else:
+        with STATS.timer("classroom list, per course (s)"):
+            files = list_course_files(classroom_service, course["id"])
+        print(f"Found {len(files)} attached Drive files in this course.")
+        if not dry_run:
+            downloaded_ids.set_course(course["id"], watermark, files)
+
+    fetch_drive_metadata(drive_service, [fid for fid, _ in files], metadata)
 
+    pending = []
     for file_id, name_hint in files:
-        if file_id in downloaded_ids:
-            # Already downloaded before
-            continue
+        meta = metadata.get(file_id)
+        changed = meta is not None and file_id in downloaded_ids and not downloaded_ids.is_current(file_id, meta)
+        if (
+            changed
+            or not downloaded_ids.downloaded_under(file_id, base_dir)
+            or (shared is not None and file_id in shared)
+        ):
+            pending.append((file_id, name_hint, course_dir, meta, changed))
+    return pending
 
-        # Get metadata from Drive
-        meta = drive_service.files().get(
-            fileId=file_id,
-            fields="name,mimeType",
-        ).execute()
 
-        fname = meta.get("name") or name_hint or file_id
-        mime_type = meta.get("mimeType")
+def download_all_for_course(
+    classroom_service,
+    drive_service,
+    course: Dict,
+    base_dir: pathlib.Path,
+    downloaded_ids: "DownloadIndex",
+    metadata: Dict[str, Dict],
+    sync: bool = False,
+    shared: SharedFiles = None,
+    cache: BlobCache = None,
+    dry_run: bool = False,
+) -> int:
+    claimed_paths: Set[pathlib.Path] = set()
+    total = 0
+    for file_id, name_hint, course_dir, meta, replace in list_course_downloads(
+        classroom_service, drive_service, course, base_dir, downloaded_ids, metadata,
+        sync=sync, shared=shared, dry_run=dry_run,
+    ):
+        total += download_course_file(
+            drive_service, file_id, name_hint, course_dir,
+            downloaded_ids, claimed_paths, meta=meta, replace=replace,
+            shared=shared, cache=cache, dry_run=dry_run,
+        )
+    return total
+
+
+def download_courses_parallel(
+    classroom_service,
+    drive_service,
+    drive_factory: Callable,
+    courses: List[Dict],
+    base_dir: pathlib.Path,
+    downloaded_ids: "DownloadIndex",
+    metadata: Dict[str, Dict],
+    workers: int,
+    per_course_workers: int,
+    sync: bool = False,
+    shared: SharedFiles = None,
+    cache: BlobCache = None,
+    dry_run: bool = False,
+) -> int:
+    """
+    Download attachments of all courses concurrently, with at most `workers`
+    downloads in flight overall and `per_course_workers` per course, extra
+    export formats of a file included.
+    Each worker thread gets its own Drive service from `drive_factory`.
+    """
+    queues: Dict[str, deque] = {}
+    for c in courses:
+        queues[c["id"]] = deque(
+            list_course_downloads(
+                classroom_service, drive_service, c, base_dir, downloaded_ids, metadata,
+                sync=sync, shared=shared, dry_run=dry_run,
+            )
+        )
 
-        fname = safe_filename(fname)
-        fname = ensure_extension(fname, mime_type)
+    local = threading.local()
+    claimed_paths: Set[pathlib.Path] = set()
+    # Slots taken per course, by files and by the extra export formats they
+    # spawn; the pool has a thread for every slot.
+    active: Dict[str, int] = {cid: 0 for cid in queues}
+    slots_lock = threading.Lock()
+
+    def take_slot(cid):
+        with slots_lock:
+            if active[cid] >= per_course_workers or sum(active.values()) >= workers:
+                return False
+            active[cid] += 1
+            return True
+
+    def release_slot(cid):
+        with slots_lock:
+            active[cid] -= 1
+
+    def on_slot(cid, fn, *args):
+        try:
+            return fn(*args)
+        finally:
+            release_slot(cid)
+
+    def run(cid, file_id, name_hint, course_dir, meta, replace):
+        if not hasattr(local, "drive"):
+            local.drive = drive_factory()
+
+        def spawn(fn):
+            if not take_slot(cid):
+                return None
+            return pool.submit(on_slot, cid, fn)
+
+        return download_course_file(
+            local.drive, file_id, name_hint, course_dir,
+            downloaded_ids, claimed_paths, meta=meta, replace=replace,
+            shared=shared, cache=cache, dry_run=dry_run, spawn=spawn,
+        )
 
-        dest_path = course_dir / fname
+    running = set()
+    total = 0
 
-        if dest_path.exists():
-            print(f"File already exists locally, skipping: {dest_path}")
-            # Still mark ID as downloaded so we don't try again next time.
-            downloaded_ids.add(file_id)
-            continue
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while running or any(queues.values()):
+            # Round-robin over courses so one large course can't starve the rest.
+            for cid, q in queues.items():
+                while q and take_slot(cid):
+                    running.add(pool.submit(on_slot, cid, run, cid, *q.popleft()))
 
-        download_drive_file(drive_service, file_id, dest_path, mime_type, dry_run=dry_run)
-        downloaded_ids.add(file_id)
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                total += fut.result()
+
+    return total
 
 
 # ---------- MAIN / CLI ----------
@@ -296,6 +1505,59 @@ def parse_args():
         action="store_true",
         help="List what would be downloaded, but do not actually download.",
     )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Re-download files that changed on Drive and only re-list courses that changed.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of files to download concurrently across all courses (default: 1).",
+    )
+    parser.add_argument(
+        "--per-course-workers",
+        type=int,
+        default=4,
+        help="With --workers, max concurrent downloads within a single course (default: 4).",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=10.0,
+        help="Max Google API requests per second; lowered automatically on quota errors (default: 10).",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Keep a copy of every download here and reuse it in later runs, "
+             "whatever --base-dir they use (default: no cache).",
+    )
+    parser.add_argument(
+        "--cache-max-gb",
+        type=float,
+        default=10.0,
+        help="With --cache-dir, evict the least recently used files past this size (default: 10).",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print per-stage timings (listing, metadata, downloads per type, exports) at the end.",
+    )
+    parser.add_argument(
+        "--export-formats",
+        type=parse_export_formats,
+        default=None,
+        help='Formats to export Google files to, e.g. "presentation=pdf,pptx;spreadsheet=xlsx,csv" '
+             "(default: Docs as PDF, Slides as PDF and PPTX, Sheets as XLSX).",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        default=None,
+        help="Write a sampled profile (speedscope JSON) and peak tracemalloc snapshot of the run to DIR.",
+    )
     return parser.parse_args()
 
 def select_courses_interactively(courses: List[Dict]) -> List[Dict]:
@@ -345,8 +1607,11 @@ def main():
 
     print("Authenticating with Google...")
     creds = get_credentials()
-    classroom_service = build("classroom", "v1", credentials=creds)
-    drive_service = build("drive", "v3", credentials=creds)
+    http_pool = PooledHttp(
+        creds, pool_size=max(10, args.workers + 2), max_rate=args.max_rate
+    )
+    classroom_service = build("classroom", "v1", http=http_pool)
+    drive_service = build("drive", "v3", http=http_pool)
 
     print("Loading download index...")
     downloaded_ids = load_index()
@@ -364,20 +1629,83 @@ def main():
 
     print(f"\nSelected {len(selected_courses)} course(s) for download.")
 
-    for c in selected_courses:
-        download_all_for_course(
+    started = time.monotonic()
+    if args.export_formats:
+        GOOGLE_DOC_TYPES.update(args.export_formats)
+    profiler = None
+    if args.profile:
+        # atexit also covers a run stopped with Ctrl+C.
+        profiler = Profiler("cli", args.profile).start()
+        atexit.register(profiler.stop)
+    total_bytes = 0
+    metadata: Dict[str, Dict] = {}
+    shared = SharedFiles()
+    cache = None
+    if args.cache_dir:
+        cache = BlobCache(args.cache_dir, int(args.cache_max_gb * 1e9))
+
+    if args.workers > 1:
+        total_bytes = download_courses_parallel(
             classroom_service,
             drive_service,
-            c,
+            lambda: build("drive", "v3", http=http_pool),
+            selected_courses,
             base_dir,
             downloaded_ids,
+            metadata,
+            args.workers,
+            max(1, args.per_course_workers),
+            sync=args.sync,
+            shared=shared,
+            cache=cache,
             dry_run=args.dry_run,
         )
+    else:
+        for c in selected_courses:
+            total_bytes += download_all_for_course(
+                classroom_service,
+                drive_service,
+                c,
+                base_dir,
+                downloaded_ids,
+                metadata,
+                sync=args.sync,
+                shared=shared,
+                cache=cache,
+                dry_run=args.dry_run,
+            )
+
+    elapsed = time.monotonic() - started
+    if cache is not None:
+        total_bytes -= cache.hit_bytes
+    print(
+        f"\nTransferred {total_bytes / 1e6:.1f} MB in {elapsed:.1f}s "
+        f"({total_bytes / 1e6 / max(elapsed, 1e-6):.2f} MB/s)."
+    )
+    if cache is not None and cache.hits:
+        print(
+            f"Copied {cache.hits} file(s) ({cache.hit_bytes / 1e6:.1f} MB) "
+            f"from the local cache in {args.cache_dir}."
+        )
+    if shared.linked:
+        print(
+            f"Linked {shared.linked} file(s) shared between courses, "
+            f"{shared.saved_bytes / 1e6:.1f} MB not downloaded again."
+        )
+    sent, opened = http_pool.reuse_stats()
+    print(
+        f"HTTP: {sent} request(s) over {opened} connection(s), "
+        f"{http_pool.retries} retried."
+    )
+    if args.stats:
+        STATS.count("API retries", http_pool.retries)
+        print("\n" + STATS.report())
+    if profiler is not None:
+        print(f"Profile written to {profiler.stop()}.*")
 
+    downloaded_ids.close()
 
     if not args.dry_run:
-        print("\nSaving download index...")
-        save_index(downloaded_ids)
         print("Done. All new files downloaded.")
     else:
         print("\nDry run completed. No files were actually downloaded.")
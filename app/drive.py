@@ -1,47 +1,74 @@
-import io
+import os
 import re
-import logging
-from googleapiclient.http import MediaIoBaseDownload
 
-logger = logging.getLogger(__name__)
+from app.metrics import DRIVE_DOWNLOAD_THROUGHPUT, DRIVE_EXPORT_SECONDS
 
+# Size of each ranged media request; also the most a single file holds in memory.
+DRIVE_CHUNK_SIZE = int(os.environ.get("DRIVE_CHUNK_SIZE", 4 * 1024 * 1024))
+# Drive accepts at most 100 calls in one batch request.
+BATCH_SIZE = 100
+META_FIELDS = "id,name,mimeType,size,modifiedTime"
+
+EXPORT_MIME_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".odt": "application/vnd.oasis.opendocument.text",
+    ".txt": "text/plain",
+    ".epub": "application/epub+zip",
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    ".odp": "application/vnd.oasis.opendocument.presentation",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".ods": "application/vnd.oasis.opendocument.spreadsheet",
+    ".csv": "text/csv",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".svg": "image/svg+xml",
+}
+
+# Google file type -> [(export MIME type, extension)]; every target is added
+# to the archive. Same defaults as the CLI's GOOGLE_DOC_TYPES.
 GOOGLE_EXPORTS = {
-    "application/vnd.google-apps.document": ("application/pdf", ".pdf"),
-    "application/vnd.google-apps.presentation": ("application/pdf", ".pdf"),
-    "application/vnd.google-apps.spreadsheet": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
-    "application/vnd.google-apps.drawing": ("image/png", ".png"),
-    "application/vnd.google-apps.jam": ("application/pdf", ".pdf"),
+    "application/vnd.google-apps.document": [("application/pdf", ".pdf")],
+    "application/vnd.google-apps.presentation": [
+        ("application/pdf", ".pdf"),
+        ("application/vnd.openxmlformats-officedocument.presentationml.presentation", ".pptx"),
+    ],
+    "application/vnd.google-apps.spreadsheet": [("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx")],
+    "application/vnd.google-apps.drawing": [("image/png", ".png")],
+    "application/vnd.google-apps.jam": [("application/pdf", ".pdf")],
 }
 
+def parse_export_formats(spec):
+    # "presentation=pdf,pptx;spreadsheet=xlsx,csv" -> GOOGLE_EXPORTS entries
+    formats = {}
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        kind, _, exts = part.partition("=")
+        targets = []
+        for ext in filter(None, (e.strip().lower() for e in exts.split(","))):
+            ext = "." + ext.lstrip(".")
+            if ext not in EXPORT_MIME_TYPES:
+                raise ValueError(f"Unknown export format {ext!r}, expected one of {', '.join(EXPORT_MIME_TYPES)}")
+            targets.append((EXPORT_MIME_TYPES[ext], ext))
+        if not targets:
+            raise ValueError(f"No export formats given for {kind!r}")
+        formats[f"application/vnd.google-apps.{kind.strip()}"] = targets
+    return formats
+
+# e.g. "presentation=pdf;spreadsheet=xlsx,csv" to override the defaults above.
+GOOGLE_EXPORTS.update(parse_export_formats(os.environ.get("GOOGLE_EXPORT_FORMATS", "")))
+
+def export_targets(meta):
+    # The (export MIME type, extension) of every archive entry a Drive file
+    # becomes; [None] for a file downloaded as is. Without metadata the type
+    # is unknown, so stream_file picks the first target itself.
+    return GOOGLE_EXPORTS.get((meta or {}).get("mimeType")) or [None]
+
 def safe_filename(name: str) -> str:
     name = re.sub(r"[^\w.\- ]+", "_", name or "file")
     return name.strip()[:80] or "file"
 
-def download_file_bytes(drive, file_id: str):
-    try:
-        meta = drive.files().get(fileId=file_id, fields="name,mimeType").execute()
-        name = safe_filename(meta.get("name"))
-        mime = meta.get("mimeType")
-
-        logger.info(f"FETCHING: {name} ({mime})")
-
-        if mime in GOOGLE_EXPORTS:
-            export_mime, ext = GOOGLE_EXPORTS[mime]
-            request = drive.files().export_media(fileId=file_id, mimeType=export_mime)
-            if not name.lower().endswith(ext):
-                name += ext
-        else:
-            request = drive.files().get_media(fileId=file_id)
-
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-
-        fh.seek(0)
-        logger.info(f"SUCCESS: {name}")
-        return name, fh.read()
-    except Exception as e:
-        logger.error(f"SKIPPED: ID {file_id} failed. Error: {e}")
-        return None, None
\ No newline at end of file
+def observe_download(source_mime, mime, size, elapsed):
+    if source_mime in GOOGLE_EXPORTS:
+        DRIVE_EXPORT_SECONDS.observe(elapsed, mime=source_mime)
+    else:
+        DRIVE_DOWNLOAD_THROUGHPUT.observe(size / max(elapsed, 1e-6), mime=mime)
@@ -0,0 +1,150 @@
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+
+from app.metrics import EXPORT_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Rendered Docs/Slides/Sheets exports, shared by every user of this instance.
+# Entries are keyed by file id + export type + modifiedTime, which a caller
+# only has after its own metadata lookup succeeded, so a hit never serves a
+# file the user can't read or a stale render of an edited one.
+# Off unless EXPORT_CACHE_DIR is set; point it at real disk, not a tmpfs
+# (RAM on Cloud Run).
+EXPORT_CACHE_DIR = os.environ.get("EXPORT_CACHE_DIR")
+# 0 also turns the cache off.
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("EXPORT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# Left behind by a crashed writer.
+STALE_TMP_SECONDS = 24 * 3600
+
+
+class ExportCache:
+    def __init__(self, root=EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._total = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def key(file_id, export_mime, modified_time):
+        if not modified_time:
+            return None
+        raw = f"{file_id}\0{export_mime}\0{modified_time}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _entries(self):
+        entries = []
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".tmp"):
+                    if time.time() - st.st_mtime > STALE_TMP_SECONDS:
+                        _remove(entry.path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _open(self, key):
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            EXPORT_CACHE_REQUESTS.inc(result="miss")
+            return None
+        try:
+            os.utime(path)  # mtime doubles as the LRU clock
+        except FileNotFoundError:
+            pass  # evicted since; the open handle still reads it
+        EXPORT_CACHE_REQUESTS.inc(result="hit")
+        return f
+
+    def _writer(self, key):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        return tmp, open(tmp, "wb")
+
+    def _commit(self, key, tmp, f):
+        f.close()
+        path = self._path(key)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        with self._lock:
+            self._total += size
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self._total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._total <= self.max_bytes:
+                break
+            _remove(path)
+            self._total -= size
+
+    def read_async(self, key, chunk_size):
+        # Chunks of a cached export, or None on a miss.
+        f = self._open(key)
+        if f is None:
+            return None
+
+        async def gen():
+            with f:
+                while chunk := await asyncio.to_thread(f.read, chunk_size):
+                    yield chunk
+
+        return gen()
+
+    async def store_async(self, key, chunks):
+        # Passes chunks through, keeping a copy that is only added to the
+        # cache once the export has been read to the end.
+        tmp, f = self._writer(key)
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+                yield chunk
+        except BaseException:
+            f.close()
+            _remove(tmp)
+            raise
+        await asyncio.to_thread(self._commit, key, tmp, f)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_export_cache = None
+_export_cache_lock = threading.Lock()
+
+
+def get_export_cache():
+    global _export_cache
+    if not EXPORT_CACHE_DIR or EXPORT_CACHE_MAX_BYTES <= 0:
+        return None
+    with _export_cache_lock:
+        if _export_cache is None:
+            try:
+                _export_cache = ExportCache()
+            except OSError as e:
+                logger.error(f"Export cache disabled, {EXPORT_CACHE_DIR} is not usable. Error: {e}")
+                return None
+        return _export_cache
@@ -0,0 +1,230 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+
+from app.profiling import profiled
+from app.zipstreamer import iter_zip_async
+
+logger = logging.getLogger(__name__)
+
+# Archives built at the same time; further jobs wait in the queue.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Background jobs are off unless JOB_DIR points at real disk: archives are
+# whole course selections, too big for a tmpfs (RAM on Cloud Run). The job
+# registry lives in this process, so each user must reach the same instance.
+JOB_DIR = os.environ.get("JOB_DIR")
+# Finished archives (and their status) are kept this long for downloading.
+JOB_TTL = int(os.environ.get("JOB_TTL", 3600))
+# How often expired archives are removed from JOB_DIR.
+JOB_PURGE_INTERVAL = int(os.environ.get("JOB_PURGE_INTERVAL", 60))
+# Minimum seconds between "progress" events sent to a job's subscribers.
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", 1))
+
+
+class Job:
+    def __init__(self, user):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.status = "queued"
+        self.files = 0
+        self.bytes = 0
+        self.downloaded = 0
+        self.expected_files = 0
+        self.expected_bytes = 0
+        self.skipped = 0
+        self.error = None
+        self.path = os.path.join(JOB_DIR, f"{self.id}.zip")
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # Everything that happened so far, replayed to each /events subscriber.
+        self.events = []
+        self._last_progress = 0
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "files": self.files,
+            "bytes": self.bytes,
+            "downloaded": self.downloaded,
+            "expected_files": self.expected_files,
+            "expected_bytes": self.expected_bytes,
+            "skipped": self.skipped,
+            "error": self.error,
+        }
+
+    def emit(self, event, **data):
+        if event == "planned":
+            self.expected_files += data["files"]
+            self.expected_bytes += data["bytes"]
+        elif event == "skip":
+            self.skipped += 1
+        self.events.append((event, data))
+
+    def progress(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        elapsed = max(now - self.started, 1e-6)
+        rate = self.downloaded / elapsed
+        eta = None
+        if rate and self.expected_bytes > self.downloaded:
+            eta = round((self.expected_bytes - self.downloaded) / rate)
+        self.emit(
+            "progress",
+            files=self.files,
+            downloaded=self.downloaded,
+            expected_files=self.expected_files,
+            expected_bytes=self.expected_bytes,
+            rate=round(rate),
+            eta=eta,
+        )
+
+
+class JobQueue:
+    """Builds ZIP archives as tasks on the server's event loop and keeps them
+    on disk, so a download survives the browser going away. The finished
+    file is served separately (with Range support).
+    """
+
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._slots = asyncio.Semaphore(workers)
+        self._tasks = set()
+        threading.Thread(target=self._purge_loop, name="job-purge", daemon=True).start()
+
+    def submit(self, user, build):
+        # Called on the event loop. build(job) returns the async generator of
+        # ZIP entries, as taken by iter_zip_async, and may report progress
+        # through job.emit; it is only started once the job gets a slot.
+        self.purge()
+        job = Job(user)
+        with self._lock:
+            self._jobs[job.id] = job
+        task = asyncio.create_task(self._run(job, build(job)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id, user):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.user != user or self._expired(job, time.time() - self.ttl):
+            return None
+        return job
+
+    @staticmethod
+    def _expired(job, cutoff):
+        return job.finished and job.finished < cutoff
+
+    def purge(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [j for j in self._jobs.values() if self._expired(j, cutoff)]
+            for job in expired:
+                del self._jobs[job.id]
+            live = {j.path for j in self._jobs.values()}
+        for job in expired:
+            _remove(job.path)
+        # Archives left behind by an earlier process, which this registry
+        # never knew about.
+        try:
+            entries = list(os.scandir(JOB_DIR))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            path = entry.path.removesuffix(".part")
+            if path in live:
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    _remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _purge_loop(self):
+        while True:
+            time.sleep(JOB_PURGE_INTERVAL)
+            try:
+                self.purge()
+            except Exception:
+                logger.exception("Purging expired jobs failed")
+
+    async def _count(self, job, path, data):
+        started = time.monotonic()
+        size = 0
+        chunks = _once(data) if isinstance(data, bytes) else data
+        async for chunk in chunks:
+            size += len(chunk)
+            job.downloaded += len(chunk)
+            job.progress()
+            yield chunk
+        job.files += 1
+        job.emit("file", path=path, bytes=size, seconds=round(time.monotonic() - started, 2))
+
+    async def _run(self, job, entries):
+        async with self._slots:
+            await self._build(job, entries)
+
+    async def _build(self, job, entries):
+        job.status = "running"
+        job.started = time.monotonic()
+        part = job.path + ".part"
+
+        async def counted():
+            async for path, data, *mime in entries:
+                if path and data is not None:
+                    data = self._count(job, path, data)
+                yield (path, data, *mime)
+
+        try:
+            os.makedirs(JOB_DIR, exist_ok=True)
+            with profiled(f"job-{job.id}"), open(part, "wb") as f:
+                async for chunk in iter_zip_async(counted()):
+                    await asyncio.to_thread(f.write, chunk)
+                    job.bytes += len(chunk)
+            os.replace(part, job.path)
+            job.status = "done"
+        except Exception as e:
+            logger.exception(f"JOB {job.id} FAILED")
+            job.status = "failed"
+            job.error = str(e)
+            _remove(part)
+        finally:
+            await entries.aclose()
+            job.finished = time.time()
+            job.progress(force=True)
+            job.emit("end", status=job.status, error=job.error)
+
+
+async def _once(data):
+    yield data
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    # None when background jobs are not configured.
+    global _queue
+    if not JOB_DIR:
+        return None
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -1,17 +1,25 @@
 import os
 import json
+import uuid
+import asyncio
 import logging
 from fastapi import FastAPI, Request, Form, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 
 from app.oauth import get_flow, SCOPES
-from app.classroom import list_all_courses, list_course_files
-from app.drive import download_file_bytes
+from app import aio
+from app.archive import archive_entries_async, cached_course_files_async, plan_parts_async
+from app.classroom import list_all_courses
+from app.cache import get_cache, user_key
+from app.jobs import get_queue
+from app.metrics import render as render_metrics
+from app.profiling import profiled_async
+from app.services import classroom_service
+from app.transport import transport_stats
 from app.zipstreamer import stream_zip
 
 logging.basicConfig(level=logging.INFO)
@@ -19,6 +27,8 @@ logger = logging.getLogger(__name__)
 
 SESSION_SECRET = os.environ.get("SESSION_SECRET")
 IS_CLOUD_RUN = os.environ.get("K_SERVICE") is not None
+# How long the part links from /download/parts keep working.
+DOWNLOAD_PARTS_TTL = int(os.environ.get("DOWNLOAD_PARTS_TTL", 3600))
 
 if not SESSION_SECRET:
     if IS_CLOUD_RUN:
@@ -89,7 +99,7 @@ def oauth_callback(request: Request):
 
 
 @app.get("/courses")
-def courses(request: Request):
+def courses(request: Request, refresh: bool = False):
     if "token" not in request.session:
         return RedirectResponse("/login")
 
@@ -97,14 +107,25 @@ def courses(request: Request):
         request.session["token"], SCOPES
     )
 
-    classroom = build("classroom", "v1", credentials=creds)
-    courses = list_all_courses(classroom)
+    cache = get_cache()
+    user = user_key(request.session["token"])
+    if refresh:
+        # Listings only; download part plans ({user}:parts:*) stay valid.
+        cache.delete(f"{user}:courses")
+        cache.delete_prefix(f"{user}:files:")
+
+    courses = cache.get(f"{user}:courses")
+    if courses is None:
+        classroom = classroom_service(creds, user=user)
+        courses = list_all_courses(classroom)
+        cache.set(f"{user}:courses", courses)
 
     return templates.TemplateResponse(
         "courses.html",
         {
             "request": request,
             "courses": courses,
+            "jobs_enabled": get_queue() is not None,
         },
     )
 
@@ -112,7 +133,7 @@ def courses(request: Request):
 # ======================= FIXED ENDPOINT =======================
 
 @app.post("/download")
-def download(
+async def download(
     request: Request,
     course_ids: list[str] = Form(None),
     file_ids: list[str] = Form(None),
@@ -124,40 +145,193 @@ def download(
         request.session["token"], SCOPES
     )
 
-    classroom = build("classroom", "v1", credentials=creds)
-    drive = build("drive", "v3", credentials=creds)
-
-    def gen():
-        if file_ids:
-            logger.info(f"=== DOWNLOADING {len(file_ids)} SELECTED FILES ===")
-            for fid in file_ids:
-                name, data = download_file_bytes(drive, fid)
-                if name and data:
-                    yield f"files/{name}", data
-        else:
-            logger.info(f"=== STARTING DOWNLOAD FOR {len(course_ids)} COURSES ===")
-            for cid in course_ids:
-                logger.info(f"Processing Course: {cid}")
-                files = list_course_files(classroom, cid)
-                for fid, _ in files:
-                    name, data = download_file_bytes(drive, fid)
-                    if name and data:
-                        yield f"{cid}/{name}", data
-        logger.info("=== ZIP GENERATION COMPLETE ===")
-
-    return stream_zip(gen())
+    user = user_key(request.session["token"])
+    return stream_zip(
+        profiled_async("download", archive_entries_async(creds, user, course_ids, file_ids))
+    )
+
+
+# Large selections as several archives: POST returns a manifest of parts,
+# each streamed from its own GET link so a failed part is simply fetched again.
+
+@app.post("/download/parts")
+async def plan_download_parts(
+    request: Request,
+    course_ids: list[str] = Form(None),
+    file_ids: list[str] = Form(None),
+    part_mb: int = Form(None),
+    per_course: bool = Form(False),
+):
+    if "token" not in request.session:
+        raise HTTPException(status_code=401)
+    if not part_mb and not per_course:
+        raise HTTPException(status_code=400, detail="Give part_mb or per_course")
+
+    creds = Credentials.from_authorized_user_info(
+        request.session["token"], SCOPES
+    )
+
+    user = user_key(request.session["token"])
+    parts = await plan_parts_async(
+        creds, user, course_ids, file_ids,
+        part_bytes=part_mb and part_mb * 1024 * 1024, per_course=per_course,
+    )
+    plan_id = uuid.uuid4().hex
+    get_cache().set(f"{user}:parts:{plan_id}", parts, ttl=DOWNLOAD_PARTS_TTL)
+    return {
+        "id": plan_id,
+        "parts": [
+            {
+                "url": f"/download/parts/{plan_id}/{n}",
+                "courses": [prefix for prefix, _ in part["groups"]],
+                "files": part["files"],
+                "bytes": part["bytes"],
+            }
+            for n, part in enumerate(parts, start=1)
+        ],
+    }
+
+
+@app.get("/download/parts/{plan_id}/{n}")
+async def download_part(request: Request, plan_id: str, n: int):
+    if "token" not in request.session:
+        return RedirectResponse("/login")
+
+    creds = Credentials.from_authorized_user_info(
+        request.session["token"], SCOPES
+    )
+
+    user = user_key(request.session["token"])
+    parts = get_cache().get(f"{user}:parts:{plan_id}")
+    if parts is None or not 1 <= n <= len(parts):
+        raise HTTPException(status_code=404)
+
+    return stream_zip(
+        profiled_async("download-part", archive_entries_async(creds, user, None, None, part=parts[n - 1])),
+        filename=f"classroom_download_part{n}_of_{len(parts)}.zip",
+    )
+
+
+# Same archive, built in the background: POST returns a job id to poll and
+# the finished ZIP is fetched from /jobs/{id}/archive (resumable). Only
+# available when JOB_DIR is set; otherwise every route below is a 404.
+
+def job_queue():
+    queue = get_queue()
+    if queue is None:
+        raise HTTPException(status_code=404, detail="Background jobs are not enabled")
+    return queue
+
+
+@app.post("/jobs")
+async def create_job(
+    request: Request,
+    course_ids: list[str] = Form(None),
+    file_ids: list[str] = Form(None),
+):
+    queue = job_queue()
+    if "token" not in request.session:
+        raise HTTPException(status_code=401)
+
+    creds = Credentials.from_authorized_user_info(
+        request.session["token"], SCOPES
+    )
+
+    user = user_key(request.session["token"])
+    job = queue.submit(
+        user, lambda job: archive_entries_async(creds, user, course_ids, file_ids, job.emit)
+    )
+    return JSONResponse(job.to_dict(), status_code=202)
+
+
+def get_job(request, job_id):
+    queue = job_queue()
+    if "token" not in request.session:
+        raise HTTPException(status_code=401)
+
+    job = queue.get(job_id, user_key(request.session["token"]))
+    if job is None:
+        raise HTTPException(status_code=404)
+    return job
+
+
+@app.get("/jobs/{job_id}")
+def job_status(request: Request, job_id: str):
+    return get_job(request, job_id).to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(request: Request, job_id: str):
+    # Server-sent events: everything so far, then new events as they happen,
+    # ending with an "end" event once the archive is done or failed. Each
+    # event's id is its index in job.events, so a reconnecting EventSource
+    # (which sends Last-Event-ID) picks up after the last one it saw.
+    job = get_job(request, job_id)
+    try:
+        sent = max(int(request.headers.get("last-event-id", -1)) + 1, 0)
+    except ValueError:
+        sent = 0
+
+    async def stream():
+        nonlocal sent
+        while not await request.is_disconnected():
+            events = job.events[sent:]
+            for n, (event, data) in enumerate(events, start=sent):
+                yield f"id: {n}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+                if event == "end":
+                    return
+            sent += len(events)
+            if job.finished and sent >= len(job.events):
+                return  # reconnected after the "end" event
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/jobs/{job_id}/archive")
+def job_archive(request: Request, job_id: str):
+    job = get_job(request, job_id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+
+    return FileResponse(
+        job.path,
+        media_type="application/zip",
+        filename="classroom_download.zip",
+    )
 
 
 # =============================================================
 
 
 @app.get("/api/courses/{course_id}/files")
-def get_course_files(request: Request, course_id: str):
+async def get_course_files(request: Request, course_id: str, refresh: bool = False):
     if "token" not in request.session:
         raise HTTPException(status_code=401)
     
     creds = Credentials.from_authorized_user_info(request.session["token"], SCOPES)
-    classroom = build("classroom", "v1", credentials=creds)
-    
-    files = list_course_files(classroom, course_id)
+    user = user_key(request.session["token"])
+    if refresh:
+        get_cache().delete(f"{user}:files:{course_id}")
+
+    api = aio.AsyncGoogle(creds, user=user)
+    [(_, files)] = [entry async for entry in cached_course_files_async(user, api, [course_id])]
     return [{"id": f[0], "name": f[1]} for f in files]
+
+
+@app.get("/api/stats/transport")
+def get_transport_stats(request: Request):
+    if "token" not in request.session:
+        raise HTTPException(status_code=401)
+
+    return transport_stats()
+
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus text format; aggregate counters only, nothing per user.
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
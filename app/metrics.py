@@ -0,0 +1,113 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Served as Prometheus text exposition from /metrics. Kept dependency-free:
+# a handful of counters and histograms is all the pipeline needs.
+
+SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+THROUGHPUT_BUCKETS = tuple(mb * 1e6 for mb in (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200))
+
+_registry = []
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, buckets=SECONDS_BUCKETS, labels=()):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.label_names = labels
+        # label values -> (per-bucket counts with +Inf last, sum, count)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0, 0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value, n + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    le = _labels(self.label_names + ("le",), key + (bound,))
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, key)} {n}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CLASSROOM_LIST_SECONDS = Histogram(
+    "classroom_list_seconds", "Time to list one course's attachments of one kind.", labels=("kind",)
+)
+DRIVE_METADATA_SECONDS = Histogram(
+    "drive_metadata_seconds", "Time per Drive metadata lookup call (a batch or a single files.get).", labels=("mode",)
+)
+DRIVE_DOWNLOAD_THROUGHPUT = Histogram(
+    "drive_download_bytes_per_second", "Throughput of each completed Drive download.",
+    buckets=THROUGHPUT_BUCKETS, labels=("mime",),
+)
+DRIVE_EXPORT_SECONDS = Histogram(
+    "drive_export_seconds", "Time to export one Google Docs/Slides/Sheets file.", labels=("mime",)
+)
+ZIP_WRITE_SECONDS = Histogram(
+    "zip_write_seconds", "CPU time spent compressing and framing one ZIP entry (excludes waiting on Drive).",
+    labels=("compression",),
+)
+ZIP_BYTES = Counter("zip_bytes_streamed_total", "Bytes of ZIP output produced, streamed or written to a job file.")
+API_RETRIES = Counter("google_api_retries_total", "Google API calls retried after a quota or transient error.", labels=("reason",))
+EXPORT_CACHE_REQUESTS = Counter(
+    "export_cache_requests_total", "Google Docs/Slides/Sheets exports looked up in the export cache.", labels=("result",)
+)
+FILES_SKIPPED = Counter("files_skipped_total", "Files left out of an archive.", labels=("reason",))
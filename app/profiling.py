@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Set PROFILE_DIR to profile every /download and background job: a sampled
+# wall-clock trace of all threads (speedscope JSON, open at speedscope.app)
+# and the tracemalloc snapshot at peak memory. Unset, nothing is sampled or
+# traced. Samples cover the whole process, so profile one download at a time.
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+# Snapshots walk every live allocation, so take one only when traced memory
+# has grown this much since the last, at most once a second.
+SNAPSHOT_GROWTH = 1.1
+TOP_ALLOCATIONS = 30
+
+_tracing = 0
+_tracing_owned = False
+_tracing_lock = threading.Lock()
+
+
+def _start_tracing():
+    # Overlapping profiles share one tracemalloc session.
+    global _tracing, _tracing_owned
+    with _tracing_lock:
+        if _tracing == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_owned = True
+        _tracing += 1
+
+
+def _stop_tracing():
+    global _tracing, _tracing_owned
+    with _tracing_lock:
+        _tracing -= 1
+        if _tracing == 0 and _tracing_owned:
+            tracemalloc.stop()
+            _tracing_owned = False
+
+
+class Profiler:
+    def __init__(self, name, directory=None, interval=None):
+        self.name = name
+        self.directory = directory or PROFILE_DIR
+        self.interval = interval or PROFILE_INTERVAL
+        self.frames = []
+        self._frame_ids = {}
+        # thread id -> [thread name, [stack], [weight]], identical
+        # consecutive samples merged into one weight
+        self.threads = {}
+        self.peak = 0
+        self.snapshot = None
+        self._snapshot_size = 0
+        self._snapshot_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        _start_tracing()
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # Returns the path prefix of the written files.
+        if self._stopped:
+            return self.prefix
+        self._stopped = True
+        self._stop.set()
+        self._thread.join()
+        self._take_snapshot()
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        _stop_tracing()
+        self.elapsed = time.perf_counter() - self.started
+
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.prefix = os.path.join(self.directory, f"{stamp}-{self.name}-{uuid.uuid4().hex[:6]}")
+        with open(self.prefix + ".speedscope.json", "w") as f:
+            json.dump(self._speedscope(), f)
+        if self.snapshot is not None:
+            self.snapshot.dump(self.prefix + ".tracemalloc")
+        with open(self.prefix + ".tracemalloc.txt", "w") as f:
+            f.write(self._allocations())
+        logger.info(f"PROFILE WRITTEN: {self.prefix}.*")
+        return self.prefix
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if name != "profiler":
+                    self._record(ident, name, frame, now - last)
+            last = now
+
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            if current > self._snapshot_size * SNAPSHOT_GROWTH and now - self._snapshot_at >= 1:
+                self._take_snapshot()
+
+    def _record(self, ident, thread_name, frame, weight):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self._frame_ids.get(key)
+            if index is None:
+                index = self._frame_ids[key] = len(self.frames)
+                self.frames.append({"name": key[0], "file": key[1], "line": key[2]})
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+
+        _, stacks, weights = self.threads.setdefault(ident, [thread_name, [], []])
+        if stacks and stacks[-1] == stack:
+            weights[-1] += weight
+        else:
+            stacks.append(stack)
+            weights.append(weight)
+
+    def _take_snapshot(self):
+        current = tracemalloc.get_traced_memory()[0]
+        if current <= self._snapshot_size:
+            return
+        self.snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        self._snapshot_size = current
+        self._snapshot_at = time.perf_counter()
+
+    def _speedscope(self):
+        profiles = []
+        for thread_name, stacks, weights in self.threads.values():
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": stacks,
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "classroom-downloader",
+            "shared": {"frames": self.frames},
+            "profiles": profiles,
+        }
+
+    def _allocations(self):
+        lines = [
+            f"{self.name}: {self.elapsed:.1f}s, peak traced memory {self.peak / 1e6:.1f} MB",
+        ]
+        if self.snapshot is not None:
+            lines.append(f"Top allocations in the largest snapshot ({self._snapshot_size / 1e6:.1f} MB):")
+            for stat in self.snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                lines.append(str(stat))
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profiled(name):
+    if not PROFILE_DIR:
+        yield
+        return
+    profiler = Profiler(name).start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+
+
+def profiled_async(name, generator):
+    # For an async generator consumed after the handler returns (a streamed
+    # response): the profile covers its whole iteration.
+    if not PROFILE_DIR:
+        return generator
+    return _profiled_async(name, generator)
+
+
+async def _profiled_async(name, generator):
+    profiler = Profiler(name).start()
+    try:
+        async for item in generator:
+            yield item
+    finally:
+        await generator.aclose()
+        profiler.stop()
@@ -0,0 +1,168 @@
+import os
+import json
+import asyncio
+import time
+import random
+import threading
+from collections import OrderedDict
+
+# Requests per second each user's limiter starts at and never exceeds; it
+# halves on every quota error and creeps back up on success.
+API_RATE_LIMIT = float(os.environ.get("API_RATE_LIMIT", 20))
+API_MIN_RATE = float(os.environ.get("API_MIN_RATE", 1))
+# Ceiling for the whole process, shared by every user. It only tightens when
+# Google reports the project (not one user) over its quota.
+API_PROJECT_RATE_LIMIT = float(os.environ.get("API_PROJECT_RATE_LIMIT", 200))
+# Users whose limiter (and any backoff it is in) is remembered.
+USER_LIMITERS = int(os.environ.get("USER_LIMITERS", 4096))
+API_MAX_RETRIES = int(os.environ.get("API_MAX_RETRIES", 6))
+# Retries allowed for a single /download job across all of its calls.
+API_RETRY_BUDGET = int(os.environ.get("API_RETRY_BUDGET", 200))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 32.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"userRateLimitExceeded", "rateLimitExceeded"}
+
+
+class RateLimiter:
+    def __init__(self, rate=API_RATE_LIMIT, min_rate=API_MIN_RATE):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        # Take a token if one is available; otherwise return how long to wait.
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, self.rate)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+
+class UserLimiter:
+    """A user's own RateLimiter paired with the process-wide project one.
+    Calls wait on both; a quota error only slows down the one it names.
+    """
+
+    def __init__(self, user, project):
+        self.user = user
+        self.project = project
+
+    def acquire(self):
+        self.user.acquire()
+        self.project.acquire()
+
+    async def acquire_async(self):
+        await self.user.acquire_async()
+        await self.project.acquire_async()
+
+    def throttled(self, status, content):
+        if is_project_limited(status, content):
+            self.project.throttled()
+        else:
+            self.user.throttled()
+
+    def succeeded(self):
+        self.user.succeeded()
+        self.project.succeeded()
+
+
+class RetryBudget:
+    def __init__(self, limit=API_RETRY_BUDGET):
+        self.remaining = limit
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            self.retries += 1
+            return True
+
+
+def _error_reasons(content):
+    try:
+        errors = json.loads(content)["error"].get("errors", [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+    return {e.get("reason") for e in errors}
+
+
+def is_rate_limited(status, content):
+    if status in RETRY_STATUSES:
+        return True
+    if status != 403:
+        return False
+    # 403 is also used for real permission errors; only the quota reasons
+    # are worth retrying.
+    return bool(_error_reasons(content) & RATE_LIMIT_REASONS)
+
+
+def is_project_limited(status, content):
+    # userRateLimitExceeded is one user's quota; rateLimitExceeded and bare
+    # 429s are the project's, which every user of this instance shares.
+    reasons = _error_reasons(content)
+    if "userRateLimitExceeded" in reasons:
+        return False
+    return status == 429 or "rateLimitExceeded" in reasons
+
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            pass
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+_project_limiter = RateLimiter(API_PROJECT_RATE_LIMIT)
+_limiters = OrderedDict()
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(user=None):
+    # One limiter per user_key, so a user hitting their quota (or just
+    # downloading a lot) doesn't slow everyone else down.
+    with _limiters_lock:
+        limiter = _limiters.get(user)
+        if limiter is None:
+            limiter = _limiters[user] = UserLimiter(RateLimiter(), _project_limiter)
+            if len(_limiters) > USER_LIMITERS:
+                _limiters.popitem(last=False)
+        else:
+            _limiters.move_to_end(user)
+        return limiter
@@ -0,0 +1,36 @@
+import json
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from app.transport import PooledHttp
+
+APIS = {
+    "classroom": "v1",
+    "drive": "v3",
+}
+
+
+def load_discovery_docs():
+    # Parsed once at import from the copies bundled with google-api-python-client,
+    # so handlers never fetch or re-parse a discovery document.
+    docs = {}
+    for name, version in APIS.items():
+        doc = get_static_doc(name, version)
+        if doc is None:
+            raise RuntimeError(f"No bundled discovery document for {name} {version}")
+        docs[name] = json.loads(doc)
+    return docs
+
+
+DISCOVERY_DOCS = load_discovery_docs()
+
+
+def get_service(name, creds, budget=None, user=None):
+    # Requests go through the shared keep-alive pool rather than a fresh
+    # httplib2.Http per service, rate limited per `user` (a user_key).
+    return build_from_document(DISCOVERY_DOCS[name], http=PooledHttp(creds, budget=budget, user=user))
+
+
+def classroom_service(creds, budget=None, user=None):
+    return get_service("classroom", creds, budget, user)
+
@@ -0,0 +1,152 @@
+import os
+import time
+import logging
+import threading
+import http.cookiejar
+
+import requests
+from requests.adapters import HTTPAdapter
+from google.auth.transport.requests import Request as AuthRequest
+
+from app.metrics import API_RETRIES
+from app.ratelimit import API_MAX_RETRIES, backoff_delay, get_limiter, is_rate_limited
+
+logger = logging.getLogger(__name__)
+
+# Keep-alive connections kept per host; size it to the number of concurrent
+# downloads (PREFETCH_AHEAD + 1 per active /download request).
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 32))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 120))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    # One process-wide session so every Classroom/Drive call, across users and
+    # threads, reuses the same TLS connections. urllib3's pools are thread-safe.
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def continues_download(headers):
+    # MediaIoBaseDownload reads a file as a run of Range requests; only the
+    # first one is an API call, the rest are more bytes of the same download.
+    for name, value in headers.items():
+        if name.lower() == "range":
+            return not value.startswith("bytes=0-")
+    return False
+
+
+class Response(dict):
+    # Shaped like httplib2.Response, which is what googleapiclient expects.
+    def __init__(self, r, content):
+        super().__init__((k.lower(), v) for k, v in r.headers.items())
+        self.status = r.status_code
+        self.reason = r.reason
+        self["status"] = str(r.status_code)
+        if "content-encoding" in self:
+            # requests already decoded the body; report it the way httplib2 does
+            # so MediaIoBaseDownload sees the real length.
+            self["-content-encoding"] = self.pop("content-encoding")
+            self["content-length"] = str(len(content))
+
+
+class PooledHttp:
+    """httplib2-compatible transport that signs requests with `credentials`
+    and sends them through the shared pooled session.
+
+    Every call waits on the rate limiter of `user` (a user_key) and is
+    retried with jittered exponential backoff on 429/5xx, rate-limit 403s and
+    connection errors. Retries are charged to `budget` (a RetryBudget) when
+    given.
+    """
+
+    def __init__(self, credentials, session=None, budget=None, user=None):
+        self.credentials = credentials
+        self.session = session or get_session()
+        self.budget = budget
+        self.limiter = get_limiter(user)
+        self._auth_request = AuthRequest(self.session)
+
+    def _send(self, uri, method, body, headers):
+        signed = dict(headers)
+        self.credentials.before_request(self._auth_request, method, uri, signed)
+        return self.session.request(
+            method, uri, data=body, headers=signed, timeout=HTTP_TIMEOUT
+        )
+
+    def _send_once(self, uri, method, body, headers):
+        r = self._send(uri, method, body, headers)
+
+        if r.status_code == 401 and getattr(self.credentials, "refresh_token", None):
+            self.credentials.refresh(self._auth_request)
+            r = self._send(uri, method, body, headers)
+
+        return r
+
+    def _retry(self, attempt):
+        if attempt >= API_MAX_RETRIES:
+            return False
+        return self.budget is None or self.budget.take()
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        headers = headers or {}
+        attempt = 0
+        charged = not continues_download(headers)
+
+        while True:
+            if charged:
+                self.limiter.acquire()
+            try:
+                r = self._send_once(uri, method, body, headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not self._retry(attempt):
+                    raise
+                delay = backoff_delay(attempt)
+                API_RETRIES.inc(reason="connection")
+                logger.warning(f"RETRY {attempt + 1}: {method} {uri} failed ({e}); waiting {delay:.1f}s")
+            else:
+                content = r.content
+                if not is_rate_limited(r.status_code, content):
+                    self.limiter.succeeded()
+                    return Response(r, content), content
+                self.limiter.throttled(r.status_code, content)
+                if not self._retry(attempt):
+                    return Response(r, content), content
+                delay = backoff_delay(attempt, r.headers.get("Retry-After"))
+                API_RETRIES.inc(reason=str(r.status_code))
+                logger.warning(f"RETRY {attempt + 1}: {method} {uri} got {r.status_code}; waiting {delay:.1f}s")
+
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        # The session is shared by the whole process; nothing to release here.
+        pass
+
+
+def transport_stats():
+    session = get_session()
+    adapter = session.get_adapter("https://")
+    pools = adapter.poolmanager.pools
+    hosts = {}
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        hosts[pool.host] = {
+            "requests": pool.num_requests,
+            "connections_opened": pool.num_connections,
+            "reused": max(pool.num_requests - pool.num_connections, 0),
+            "idle": pool.pool.qsize() if pool.pool else 0,
+        }
+    return {"pool_size": HTTP_POOL_SIZE, "hosts": hosts}
@@ -1,24 +1,148 @@
-import zipstream
+import os
+import time
+import zlib
+import asyncio
 import logging
+import mimetypes
+from collections import deque
+import zipstream
 from fastapi.responses import StreamingResponse
 
+from app.metrics import ZIP_BYTES, ZIP_WRITE_SECONDS
+
 logger = logging.getLogger(__name__)
 
-def stream_zip(generator):
+ZIP_DEFLATE_LEVEL = int(os.environ.get("ZIP_DEFLATE_LEVEL", 6))
+
+# Formats that are already compressed (or are zip containers themselves);
+# deflating them costs CPU for next to no size gain.
+STORED_MIME_PREFIXES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/vnd.openxmlformats-officedocument.",
+    "application/vnd.oasis.opendocument.",
+)
+STORED_MIME_TYPES = {
+    "application/pdf",
+    "application/zip",
+    "application/gzip",
+    "application/x-7z-compressed",
+    "application/vnd.rar",
+    "application/epub+zip",
+}
+# Image formats that do compress well.
+DEFLATED_MIME_TYPES = {"image/svg+xml", "image/bmp", "image/tiff", "image/x-ms-bmp"}
+
+_default_compressor = getattr(zipstream, "_get_compressor", None)
+
+
+def _get_compressor(compress_type):
+    if compress_type == zipstream.ZIP_DEFLATED:
+        return zlib.compressobj(ZIP_DEFLATE_LEVEL, zlib.DEFLATED, -15)
+    return _default_compressor(compress_type)
+
+
+# zipstream hardcodes the default zlib level; swap in one that honours
+# ZIP_DEFLATE_LEVEL. _get_compressor is private (zipstream-new is pinned for
+# it), so a release without it keeps working at zlib's default level.
+if callable(_default_compressor):
+    zipstream._get_compressor = _get_compressor
+else:
+    logger.warning("zipstream has no _get_compressor; ZIP_DEFLATE_LEVEL is ignored")
+
+
+def compression_for(path, mime=None):
+    mime = mime or mimetypes.guess_type(path)[0]
+    if not mime or mime in DEFLATED_MIME_TYPES:
+        return zipstream.ZIP_DEFLATED
+    if mime in STORED_MIME_TYPES or mime.startswith(STORED_MIME_PREFIXES):
+        return zipstream.ZIP_STORED
+    return zipstream.ZIP_DEFLATED
+
+
+def _label(compress_type):
+    return "stored" if compress_type == zipstream.ZIP_STORED else "deflated"
+
+
+def _finish(z):
+    size = 0
+    for piece in z:
+        size += len(piece)
+        yield piece
+    ZIP_BYTES.inc(size)
+
+
+class _Feed:
+    # Iterator handed to zipstream for one entry; chunks are pushed into it
+    # from async code, one at a time, between steps of the zip generator.
+    def __init__(self):
+        self.chunks = deque()
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.chunks:
+            return self.chunks.popleft()
+        if self.done:
+            raise StopIteration
+        raise RuntimeError("zip writer read ahead of the async source")
+
+
+async def iter_zip_async(generator):
+    # Pull one (path, async chunks[, mime]) entry at a time and flush it
+    # straight out, so the next file is only consumed once the client has
+    # taken the current one. zipstream pulls one input chunk per step, so
+    # each chunk is fed in and the writer stepped until it has taken it.
+    # Compressing a chunk is CPU work, so that step runs off the event loop.
     z = zipstream.ZipFile(mode="w", compression=zipstream.ZIP_DEFLATED)
 
-    
-    for path, data in generator:
-        if path and data:
-            z.write_iter(path, [data])
-            logger.info(f"ADDED TO ZIP: {path}")
+    async for path, data, *mime in generator:
+        if not path or data is None:
+            continue
+        if isinstance(data, bytes):
+            data = _aiter_once(data)
+        feed = _Feed()
+        compress_type = compression_for(path, *mime)
+        z.write_iter(path, feed, compress_type=compress_type)
+        out = z.flush()
+        busy = 0.0
+        header = next(out)
+        size = len(header)
+        yield header
+        async for chunk in data:
+            feed.chunks.append(chunk)
+            while feed.chunks:
+                started = time.perf_counter()
+                piece = await asyncio.to_thread(next, out)
+                busy += time.perf_counter() - started
+                size += len(piece)
+                yield piece
+        feed.done = True
+        for piece in out:
+            size += len(piece)
+            yield piece
+        ZIP_WRITE_SECONDS.observe(busy, compression=_label(compress_type))
+        ZIP_BYTES.inc(size)
+        logger.info(f"ADDED TO ZIP: {path}")
+
+    for piece in _finish(z):
+        yield piece
+
+
+async def _aiter_once(data):
+    yield data
+
 
+def stream_zip(generator, filename="classroom_download.zip"):
     return StreamingResponse(
-        z,
+        iter_zip_async(generator),
         media_type="application/zip",
         headers={
-            "Content-Disposition": "attachment; filename=classroom_download.zip",
+            "Content-Disposition": f"attachment; filename={filename}",
             "Cache-Control": "no-cache",
             "X-Accel-Buffering": "no",
         },
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,244 @@
+"""End-to-end download benchmark against benchmarks.fake_google.
+
+Runs the CLI and/or the web app's /download in a child process pointed at a
+local fake Classroom/Drive server and reports throughput, time to first
+byte, the child's peak RSS and the API calls it made (including injected
+429s). Nothing talks to Google. Run from the repository root:
+
+    python -m benchmarks.end_to_end [--target cli|web|all] [--workers 4] [--clients 1]
+        [--courses 4] [--files 25] [--latency-ms 20] [--error-rate 0.02] ...
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import importlib.util
+import threading
+import subprocess
+
+import requests
+
+from benchmarks import fake_google
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_TOKEN = {
+    "token": "benchmark",
+    "refresh_token": "benchmark",
+    "client_id": "benchmark",
+    "client_secret": "benchmark",
+    "expiry": "2999-01-01T00:00:00Z",
+}
+
+
+def point_docs_at(docs, root):
+    # Rewrite the discovery documents so every call, batches included,
+    # goes to the fake server.
+    for doc in docs.values():
+        doc["rootUrl"] = root
+        doc["baseUrl"] = root + doc["servicePath"]
+
+
+def run_cli_child(root, cli_args):
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build_from_document
+    from app.services import load_discovery_docs
+
+    docs = load_discovery_docs()
+    point_docs_at(docs, root)
+
+    spec = importlib.util.spec_from_file_location("classroom_downloader", os.path.join(ROOT, "cli", "classroom_downloader.py"))
+    cli = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cli)
+    cli.get_credentials = lambda: Credentials(token="benchmark")
+    cli.build = lambda name, version, http=None: build_from_document(docs[name], http=http)
+
+    sys.argv = ["classroom_downloader.py", *cli_args]
+    cli.main()
+
+
+def run_web_child(root, port):
+    # A fresh export cache per server, so one config never serves another's
+    # cached exports.
+    with tempfile.TemporaryDirectory(prefix="bench-exports-") as exports:
+        os.environ["EXPORT_CACHE_DIR"] = exports
+        serve_web(root, port)
+
+
+def serve_web(root, port):
+    import uvicorn
+    from fastapi import Request
+    from app import aio, main, services
+
+    point_docs_at(services.DISCOVERY_DOCS, root)
+    aio.CLASSROOM_API = root + "v1"
+    aio.DRIVE_API = root + "drive/v3"
+    aio.DRIVE_BATCH_API = root + "batch/drive/v3"
+
+    @main.app.get("/_benchmark/login")
+    def login(request: Request):
+        request.session["token"] = BENCH_TOKEN
+        return {}
+
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def wait_child(proc):
+    # wait4 reports the peak RSS of this child alone (KiB on Linux).
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return usage.ru_maxrss * 1024
+
+
+def child(mode, *args, cwd=None, quiet=True):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.end_to_end", mode, *args],
+        cwd=cwd or ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL if quiet else None,
+    )
+
+
+def dir_bytes(path):
+    return sum(
+        os.path.getsize(os.path.join(d, f))
+        for d, _, files in os.walk(path) for f in files
+    )
+
+
+def bench_cli(fake, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "downloads")
+        started = time.monotonic()
+        proc = child("_cli", fake.root, "--base-dir", out, "--workers", str(args.workers), cwd=tmp)
+        rss = wait_child(proc)
+        elapsed = time.monotonic() - started
+        if proc.returncode:
+            raise SystemExit(f"CLI exited with {proc.returncode}")
+        return {
+            "bytes": dir_bytes(out),
+            "seconds": elapsed,
+            "ttfb": None,
+            "first_media": fake.first_media and fake.first_media - started,
+            "rss": rss,
+        }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_web(fake, args):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    proc = child("_web", fake.root, str(port))
+    try:
+        for _ in range(100):
+            try:
+                requests.get(base + "/_benchmark/login", timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        else:
+            raise SystemExit("web app did not start")
+
+        course_ids = [c["id"] for c in fake.courses]
+        results = []
+
+        def client():
+            session = requests.Session()
+            session.get(base + "/_benchmark/login")
+            sent = time.monotonic()
+            ttfb, size = None, 0
+            with session.post(base + "/download", data={"course_ids": course_ids}, stream=True) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(1024 * 1024):
+                    if ttfb is None:
+                        ttfb = time.monotonic() - sent
+                    size += len(chunk)
+            results.append((ttfb, size))
+
+        fake.reset_stats()
+        started = time.monotonic()
+        threads = [threading.Thread(target=client) for _ in range(args.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+    finally:
+        proc.send_signal(signal.SIGINT)
+    rss = wait_child(proc)
+
+    return {
+        "bytes": sum(size for _, size in results),
+        "seconds": elapsed,
+        "ttfb": max((t for t, _ in results if t is not None), default=None),
+        "first_media": fake.first_media and fake.first_media - started,
+        "rss": rss,
+    }
+
+
+def report(target, fake, result):
+    mb = result["bytes"] / 1e6
+    line = (
+        f"{target:<4} {mb:8.1f} MB in {result['seconds']:6.2f}s "
+        f"({mb / max(result['seconds'], 1e-6):7.2f} MB/s)"
+    )
+    if result["ttfb"] is not None:
+        line += f", TTFB {result['ttfb']:.2f}s"
+    if result["first_media"] is not None:
+        line += f", first Drive byte {result['first_media']:.2f}s"
+    line += f", peak RSS {result['rss'] / 1e6:.0f} MB"
+    print(line)
+    calls = ", ".join(f"{name}={n}" for name, n in sorted(fake.calls.items()))
+    print(f"     API calls: {calls}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "_cli":
+        return run_cli_child(sys.argv[2], sys.argv[3:])
+    if len(sys.argv) > 1 and sys.argv[1] == "_web":
+        return run_web_child(sys.argv[2], int(sys.argv[3]))
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=["cli", "web", "all"], default="all")
+    parser.add_argument("--workers", type=int, default=4, help="CLI --workers (default: 4)")
+    parser.add_argument("--clients", type=int, default=1, help="Concurrent /download requests (default: 1)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    fake_google.add_arguments(parser)
+    args = parser.parse_args()
+
+    fake = fake_google.from_args(args).start()
+    print(
+        f"fake API: {len(fake.courses)} courses, {len(fake.files)} files, "
+        f"{fake.total_bytes / 1e6:.1f} MB, latency {args.latency_ms:.0f} ms, "
+        f"429 rate {args.error_rate:.0%}"
+    )
+
+    results = {}
+    try:
+        for target, bench in (("cli", bench_cli), ("web", bench_web)):
+            if args.target not in (target, "all"):
+                continue
+            fake.reset_stats()
+            result = bench(fake, args)
+            result["calls"] = dict(fake.calls)
+            results[target] = result
+            if not args.json:
+                report(target, fake, result)
+    finally:
+        fake.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""Local stand-in for the Classroom and Drive endpoints this project calls.
+
+Serves courses.list, courseWork.list, courseWorkMaterials.list, files.get
+(metadata, alt=media with Range, and batched lookups) and files.export over
+plain HTTP, with configurable latency, per-response bandwidth, file-size
+distribution, injected 429s and downloads cut off mid-file (fail_after).
+Point a client at it by replacing the discovery documents' rootUrl with
+FakeGoogle.root (see benchmarks.end_to_end).
+
+    python -m benchmarks.fake_google [--port 8900] [--courses 4] [--files 25]
+"""
+import io
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+POOL_SIZE = 4 * 1024 * 1024
+WRITE_CHUNK = 256 * 1024
+
+DOC_MIME = "application/vnd.google-apps.document"
+# (extension, mimeType) for uploaded (binary) files
+BINARY_TYPES = [
+    (".pdf", "application/pdf"),
+    (".jpg", "image/jpeg"),
+    (".mp4", "video/mp4"),
+    (".pptx", "application/vnd.openxmlformats-officedocument.presentationml.presentation"),
+]
+
+
+class FakeFile:
+    def __init__(self, file_id, name, mime, size, offset):
+        self.id = file_id
+        self.name = name
+        self.mime = mime
+        self.size = size
+        self.offset = offset
+        self.md5 = None
+
+
+class FakeGoogle:
+    def __init__(
+        self,
+        courses=4,
+        files=25,
+        median_kb=512,
+        sigma=1.0,
+        max_mb=64,
+        docs=0.1,
+        latency=0.0,
+        bandwidth=0,
+        error_rate=0.0,
+        page_size=100,
+        seed=0,
+        port=0,
+    ):
+        rng = random.Random(seed)
+        # Every file is a window onto one random pool, so contents are
+        # deterministic (md5 checks pass) and don't compress.
+        self.pool = rng.randbytes(POOL_SIZE)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self._rng = rng
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.served_bytes = 0
+        self.first_media = None
+        # file id -> bytes of its media sent before the connection is dropped
+        self.fail_after = {}
+
+        self.courses = []
+        self.course_files = {}
+        self.files = {}
+        for c in range(courses):
+            cid = f"c{c}"
+            self.courses.append({
+                "id": cid,
+                "name": f"Course {c}",
+                "courseState": "ACTIVE",
+                "updateTime": "2024-01-01T00:00:00Z",
+            })
+            self.course_files[cid] = []
+            for n in range(files):
+                fid = f"{cid}f{n}"
+                size = int(min(max_mb * 1024 * 1024, median_kb * 1024 * math.exp(rng.gauss(0, sigma))))
+                if rng.random() < docs:
+                    f = FakeFile(fid, f"Notes {c}-{n}", DOC_MIME, size, rng.randrange(POOL_SIZE))
+                else:
+                    ext, mime = rng.choice(BINARY_TYPES)
+                    f = FakeFile(fid, f"File {c}-{n}{ext}", mime, size, rng.randrange(POOL_SIZE))
+                self.files[fid] = f
+                self.course_files[cid].append(f)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _handler(self))
+        self.server.daemon_threads = True
+        self.root = f"http://127.0.0.1:{self.server.server_port}/"
+
+    @property
+    def total_bytes(self):
+        return sum(f.size for f in self.files.values())
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls.clear()
+            self.served_bytes = 0
+            self.first_media = None
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def throttled(self):
+        with self._lock:
+            hit = self._rng.random() < self.error_rate
+            if hit:
+                self.calls["429 injected"] += 1
+        return hit
+
+    def chunks(self, f, start, end):
+        pos = start
+        while pos < end:
+            i = (f.offset + pos) % POOL_SIZE
+            n = min(WRITE_CHUNK, end - pos, POOL_SIZE - i)
+            yield self.pool[i:i + n]
+            pos += n
+
+    def md5(self, f):
+        if f.md5 is None:
+            digest = hashlib.md5()
+            for chunk in self.chunks(f, 0, f.size):
+                digest.update(chunk)
+            f.md5 = digest.hexdigest()
+        return f.md5
+
+    def metadata(self, f):
+        meta = {
+            "id": f.id,
+            "name": f.name,
+            "mimeType": f.mime,
+            "modifiedTime": "2024-01-01T00:00:00.000Z",
+        }
+        if f.mime != DOC_MIME:
+            meta["size"] = str(f.size)
+            meta["md5Checksum"] = self.md5(f)
+        return meta
+
+    def listing(self, key, items, query):
+        start = int(query.get("pageToken", ["0"])[0])
+        size = int(query.get("pageSize", [self.page_size])[0])
+        resp = {key: items[start:start + size]}
+        if start + size < len(items):
+            resp["nextPageToken"] = str(start + size)
+        return resp
+
+    def attachments(self, cid, collection):
+        files = self.course_files[cid]
+        # Even files are posted as assignments, odd ones as materials.
+        share = files[0::2] if collection == "courseWork" else files[1::2]
+        return [
+            {
+                "title": f.name,
+                "updateTime": "2024-01-01T00:00:00Z",
+                "materials": [{"driveFile": {"driveFile": {"id": f.id, "title": f.name}}}],
+            }
+            for f in share
+        ]
+
+
+def _handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if fake.latency:
+                time.sleep(fake.latency)
+            if fake.throttled():
+                return self.send_json(429, {"error": {"code": 429, "message": "Rate limit exceeded"}})
+
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = url.path.strip("/").split("/")
+
+            if parts[:2] == ["v1", "courses"]:
+                return self.classroom(parts[2:], query)
+            if parts[:3] == ["drive", "v3", "files"] and len(parts) >= 4:
+                return self.drive(parts[3], parts[4:], query)
+            self.send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if fake.latency:
+                time.sleep(fake.latency)
+            if urlparse(self.path).path != "/batch/drive/v3":
+                return self.send_json(404, {"error": {"code": 404, "message": "Not found"}})
+            fake.count("batch")
+            if fake.throttled():
+                return self.send_json(429, {"error": {"code": 429, "message": "Rate limit exceeded"}})
+            self.batch(body)
+
+        def classroom(self, rest, query):
+            if not rest:
+                fake.count("courses.list")
+                return self.send_json(200, fake.listing("courses", fake.courses, query))
+            cid = rest[0]
+            if cid not in fake.course_files or len(rest) != 2:
+                return self.send_json(404, {"error": {"code": 404, "message": "Course not found"}})
+            collection = rest[1]
+            fake.count(f"{collection}.list")
+            key = "courseWork" if collection == "courseWork" else "courseWorkMaterial"
+            self.send_json(200, fake.listing(key, fake.attachments(cid, collection), query))
+
+        def drive(self, fid, rest, query):
+            f = fake.files.get(fid)
+            if f is None:
+                return self.send_json(404, {"error": {"code": 404, "message": "File not found"}})
+            if rest == ["export"]:
+                fake.count("files.export")
+                return self.media(f, ranged=False)
+            if query.get("alt") == ["media"]:
+                fake.count("files.get_media")
+                return self.media(f, ranged=True)
+            fake.count("files.get")
+            self.send_json(200, fake.metadata(f))
+
+        def media(self, f, ranged):
+            start, end, status = 0, f.size, 200
+            header = self.headers.get("Range") if ranged else None
+            if header and header.startswith("bytes="):
+                first, _, last = header[6:].partition("-")
+                start = int(first or 0)
+                end = min(f.size, int(last) + 1) if last else f.size
+                status = 206
+
+            with fake._lock:
+                if fake.first_media is None:
+                    fake.first_media = time.monotonic()
+
+            self.send_response(status)
+            self.send_header("Content-Type", f.mime if ranged else "application/pdf")
+            self.send_header("Content-Length", str(end - start))
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end - 1}/{f.size}")
+            self.end_headers()
+            cut = fake.fail_after.get(f.id)
+            sent = start
+            for chunk in fake.chunks(f, start, end):
+                if cut is not None and sent + len(chunk) > cut:
+                    # Short of the promised Content-Length: the client sees
+                    # the connection drop mid-body.
+                    self.wfile.write(chunk[:max(cut - sent, 0)])
+                    sent = max(cut, sent)
+                    self.close_connection = True
+                    break
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if fake.bandwidth:
+                    time.sleep(len(chunk) / fake.bandwidth)
+            with fake._lock:
+                fake.served_bytes += sent - start
+
+        def batch(self, body):
+            # multipart/mixed of embedded HTTP requests, answered in kind.
+            message = BytesParser().parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body
+            )
+            out = io.BytesIO()
+            boundary = "batch_fake_google"
+            for part in message.get_payload():
+                request_line = part.get_payload(decode=True).split(b"\r\n", 1)[0].decode()
+                url = urlparse(request_line.split(" ")[1])
+                fid = url.path.rstrip("/").split("/")[-1]
+                f = fake.files.get(fid)
+                fake.count("batch.files.get")
+                if f is None:
+                    status, payload = "404 Not Found", {"error": {"code": 404, "message": "File not found"}}
+                else:
+                    status, payload = "200 OK", fake.metadata(f)
+                content_id = part["Content-ID"].strip("<>")
+                body = json.dumps(payload)
+                out.write(
+                    f"--{boundary}\r\nContent-Type: application/http\r\n"
+                    f"Content-ID: <response-{content_id}>\r\n\r\n"
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n{body}\r\n".encode()
+                )
+            out.write(f"--{boundary}--\r\n".encode())
+            self.send_body(200, out.getvalue(), f"multipart/mixed; boundary={boundary}")
+
+        def send_json(self, status, payload):
+            self.send_body(status, json.dumps(payload).encode(), "application/json")
+
+        def send_body(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def add_arguments(parser):
+    parser.add_argument("--courses", type=int, default=4, help="Number of courses (default: 4)")
+    parser.add_argument("--files", type=int, default=25, help="Drive files per course (default: 25)")
+    parser.add_argument("--median-kb", type=float, default=512, help="Median file size in KB (default: 512)")
+    parser.add_argument("--sigma", type=float, default=1.0, help="Spread of the log-normal file sizes (default: 1.0)")
+    parser.add_argument("--max-mb", type=float, default=64, help="Largest file in MB (default: 64)")
+    parser.add_argument("--docs", type=float, default=0.1, help="Share of Google Docs served via export (default: 0.1)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Delay before every response (default: 20)")
+    parser.add_argument("--bandwidth-mbps", type=float, default=0, help="Per-response bandwidth cap, 0 for none (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429 (default: 0)")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def from_args(args, port=0):
+    return FakeGoogle(
+        courses=args.courses,
+        files=args.files,
+        median_kb=args.median_kb,
+        sigma=args.sigma,
+        max_mb=args.max_mb,
+        docs=args.docs,
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_mbps * 1e6 / 8,
+        error_rate=args.error_rate,
+        seed=args.seed,
+        port=port,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    fake = from_args(args, port=args.port)
+    print(f"Serving {len(fake.files)} files ({fake.total_bytes / 1e6:.1f} MB) at {fake.root}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Per-request cost of creating Classroom/Drive service objects.
+
+Compares googleapiclient's build() (reads and parses the discovery document on
+every call) with app.services, which parses the bundled documents once at
+startup. Run from the repository root:
+
+    python -m benchmarks.service_build
+"""
+import timeit
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from app.services import APIS, get_service
+
+ROUNDS = 200
+
+
+def main():
+    creds = Credentials(token="benchmark")
+
+    for name, version in APIS.items():
+        per_build = timeit.timeit(
+            lambda: build(name, version, credentials=creds, cache_discovery=False),
+            number=ROUNDS,
+        ) / ROUNDS
+        per_cached = timeit.timeit(
+            lambda: get_service(name, creds),
+            number=ROUNDS,
+        ) / ROUNDS
+        print(
+            f"{name:<10} build(): {per_build * 1000:7.3f} ms   "
+            f"cached doc: {per_cached * 1000:7.3f} ms   "
+            f"saved: {(per_build - per_cached) * 1000:7.3f} ms/request"
+        )
+
+
+if __name__ == "__main__":
+    main()
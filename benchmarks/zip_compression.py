@@ -0,0 +1,124 @@
+"""CPU cost of the per-entry ZIP compression policy.
+
+Builds a synthetic corpus shaped like a typical Classroom course (mostly
+PDFs, slides/sheets exports, photos and lecture videos, plus some plain
+text and code) and streams it through app.zipstreamer.iter_zip_async twice:
+once deflating every entry, once with the content-aware policy. Reports
+CPU-seconds per GB of input and archive size for both.
+
+    python -m benchmarks.zip_compression [--mb 256]
+"""
+import io
+import os
+import time
+import asyncio
+import random
+import zipfile
+import argparse
+
+import zipstream
+
+from app import zipstreamer
+
+CHUNK = 1024 * 1024
+
+# (extension, share of total bytes)
+CORPUS = [
+    (".pdf", 0.35),
+    (".pptx", 0.15),
+    (".xlsx", 0.05),
+    (".jpg", 0.10),
+    (".mp4", 0.25),
+    (".txt", 0.05),
+    (".py", 0.05),
+]
+
+WORDS = (
+    b"assignment lecture notes week submit due homework reading chapter "
+    b"exercise solution quiz lab report grade rubric project def return "
+)
+
+
+def _text(size, rng):
+    words = WORDS.split()
+    out = bytearray()
+    while len(out) < size:
+        out += b" ".join(rng.choice(words) for _ in range(64)) + b"\n"
+    return bytes(out[:size])
+
+
+def _office(size, rng):
+    # Office files are zip containers of XML: compressed, but not random.
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        part = 0
+        while buf.tell() < size:
+            z.writestr(f"ppt/slides/slide{part}.xml", _text(CHUNK, rng))
+            z.writestr(f"ppt/media/image{part}.png", os.urandom(CHUNK // 2))
+            part += 1
+    return buf.getvalue()[:size]
+
+
+def build_corpus(total_bytes, seed=0):
+    rng = random.Random(seed)
+    files = []
+    for ext, share in CORPUS:
+        size = int(total_bytes * share)
+        if ext in (".txt", ".py"):
+            data = _text(size, rng)
+        elif ext in (".pptx", ".xlsx"):
+            data = _office(size, rng)
+        else:
+            data = os.urandom(size)
+        files.append((f"course/file{ext}", data))
+    return files
+
+
+async def _chunks(data):
+    for i in range(0, len(data), CHUNK):
+        yield data[i:i + CHUNK]
+
+
+async def _entries(files):
+    for path, data in files:
+        yield path, _chunks(data)
+
+
+async def _archive_size(files):
+    return sum([len(block) async for block in zipstreamer.iter_zip_async(_entries(files))])
+
+
+def run(files, policy):
+    original = zipstreamer.compression_for
+    if not policy:
+        zipstreamer.compression_for = lambda path, mime=None: zipstream.ZIP_DEFLATED
+    try:
+        started = time.process_time()
+        size = asyncio.run(_archive_size(files))
+        return time.process_time() - started, size
+    finally:
+        zipstreamer.compression_for = original
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=256, help="Corpus size in MB (default: 256)")
+    args = parser.parse_args()
+
+    files = build_corpus(args.mb * 1024 * 1024)
+    gb = sum(len(d) for _, d in files) / 1024 ** 3
+
+    deflate_cpu, deflate_size = run(files, policy=False)
+    policy_cpu, policy_size = run(files, policy=True)
+
+    print(f"corpus: {gb * 1024:.0f} MB, deflate level {zipstreamer.ZIP_DEFLATE_LEVEL}")
+    print(f"deflate everything: {deflate_cpu / gb:6.2f} CPU-s/GB, archive {deflate_size / 1024 ** 2:8.1f} MB")
+    print(f"content-aware:      {policy_cpu / gb:6.2f} CPU-s/GB, archive {policy_size / 1024 ** 2:8.1f} MB")
+    print(
+        f"saved {(deflate_cpu - policy_cpu) / gb:.2f} CPU-s/GB "
+        f"for {(policy_size - deflate_size) / 1024 ** 2:+.1f} MB of archive size"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import pytest
+
+from benchmarks.fake_google import FakeGoogle
+
+
+@pytest.fixture
+def fake():
+    # Two courses of six small files, about a third of them Google Docs.
+    fake = FakeGoogle(courses=2, files=6, median_kb=64, docs=0.3).start()
+    yield fake
+    fake.stop()
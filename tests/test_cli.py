@@ -0,0 +1,75 @@
+import hashlib
+
+import pytest
+
+from benchmarks.end_to_end import child, wait_child
+
+MEDIA_CALLS = ("files.get_media", "files.export")
+
+
+def run_cli(fake, cwd, *args):
+    # In its own process like a real run; the download index lives in cwd.
+    fake.reset_stats()
+    proc = child("_cli", fake.root, *args, cwd=cwd)
+    wait_child(proc)
+    assert proc.returncode == 0
+    return fake.calls
+
+
+def media_calls(calls):
+    return {name: calls[name] for name in MEDIA_CALLS if calls[name]}
+
+
+def tree(base):
+    return {
+        str(path.relative_to(base)): path.read_bytes()
+        for path in sorted(base.rglob("*")) if path.is_file()
+    }
+
+
+def first_binary(fake):
+    return next(f for f in fake.course_files["c0"] if f.mime != "application/vnd.google-apps.document")
+
+
+def version_tag(version):
+    return hashlib.sha1(version.encode()).hexdigest()[:12]
+
+
+@pytest.mark.parametrize("kept", ["truncated", "foreign"])
+def test_resumes_only_a_part_of_the_same_version(fake, tmp_path, kept):
+    f = first_binary(fake)
+    data = b"".join(fake.chunks(f, 0, f.size))
+    course_dir = tmp_path / "out" / "Course 0"
+    course_dir.mkdir(parents=True)
+    if kept == "truncated":
+        # Left by an interrupted run against the same Drive version.
+        reused = f.size // 2
+        (course_dir / f"{f.name}.{version_tag(fake.md5(f))}.part").write_bytes(data[:reused])
+    else:
+        # Left by a run against a version Drive no longer has.
+        reused = 0
+        (course_dir / f"{f.name}.{version_tag('stale')}.part").write_bytes(b"x" * (f.size // 2))
+
+    run_cli(fake, tmp_path, "--base-dir", str(tmp_path / "out"))
+
+    assert (course_dir / f.name).read_bytes() == data
+    assert not list(course_dir.glob("*.part"))
+    assert fake.served_bytes == sum(g.size for g in fake.files.values()) - reused
+
+
+def test_second_sync_run_downloads_nothing(fake, tmp_path):
+    first = run_cli(fake, tmp_path, "--base-dir", str(tmp_path / "out"), "--sync")
+    assert media_calls(first)
+
+    second = run_cli(fake, tmp_path, "--base-dir", str(tmp_path / "out"), "--sync")
+    assert media_calls(second) == {}
+
+
+def test_cache_dir_is_reused_across_base_dirs(fake, tmp_path):
+    cache = str(tmp_path / "cache")
+    run_cli(fake, tmp_path, "--base-dir", str(tmp_path / "a"), "--cache-dir", cache)
+
+    calls = run_cli(fake, tmp_path, "--base-dir", str(tmp_path / "b"), "--cache-dir", cache)
+
+    assert media_calls(calls) == {}
+    assert tree(tmp_path / "b") == tree(tmp_path / "a")
@@ -0,0 +1,61 @@
+import io
+import uuid
+import asyncio
+import zipfile
+
+import httpx
+import pytest
+from google.oauth2.credentials import Credentials
+
+from app import aio
+from app.archive import archive_entries_async
+from app.drive import DRIVE_CHUNK_SIZE, GOOGLE_EXPORTS, safe_filename
+from app.zipstreamer import iter_zip_async
+
+
+@pytest.fixture(autouse=True)
+def google(fake, monkeypatch):
+    monkeypatch.setattr(aio, "CLASSROOM_API", fake.root + "v1")
+    monkeypatch.setattr(aio, "DRIVE_API", fake.root + "drive/v3")
+    monkeypatch.setattr(aio, "DRIVE_BATCH_API", fake.root + "batch/drive/v3")
+
+
+def build_archive(course_ids):
+    async def run():
+        # A fresh user each time, so listings are never served from the cache.
+        entries = archive_entries_async(Credentials(token="test"), uuid.uuid4().hex, course_ids, None)
+        return b"".join([chunk async for chunk in iter_zip_async(entries)])
+
+    return zipfile.ZipFile(io.BytesIO(asyncio.run(run())))
+
+
+def listed(fake, cid):
+    # Classroom order: assignments (even files) first, then materials.
+    files = fake.course_files[cid]
+    return files[0::2] + files[1::2]
+
+
+def test_archive_keeps_listing_order(fake):
+    archive = build_archive(["c0", "c1"])
+
+    expected = []
+    for cid in ["c0", "c1"]:
+        for f in listed(fake, cid):
+            name = safe_filename(f.name)
+            for _, ext in GOOGLE_EXPORTS.get(f.mime, [(None, "")]):
+                expected.append((f"{cid}/{name}{ext}", f))
+
+    assert archive.namelist() == [path for path, _ in expected]
+    assert archive.testzip() is None
+    for path, f in expected:
+        assert archive.read(path) == b"".join(fake.chunks(f, 0, f.size))
+
+
+def test_error_mid_file_fails_the_archive(fake):
+    # Past the first chunk, so the entry is already open when the drop hits.
+    f = next(f for f in listed(fake, "c0") if f.mime != "application/vnd.google-apps.document")
+    f.size = DRIVE_CHUNK_SIZE + 2 * 1024 * 1024
+    fake.fail_after[f.id] = DRIVE_CHUNK_SIZE + 1024 * 1024
+
+    with pytest.raises(httpx.HTTPError):
+        build_archive(["c0"])